@@ -1,9 +1,15 @@
 import os
-import json
+import re
+import orjson
 import random
 import logging
-from datetime import timedelta
+import argparse
+import hashlib
+import pickle
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook
 
 # ---------------- Logging ---------------- #
@@ -20,6 +26,7 @@ NOTE_SHEET = "Note Activity"
 ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
+CACHE_DIR = ".cache"
 
 # ---- Case selection ----
 # CASE_SELECTION = "all"   # all cases
@@ -28,16 +35,86 @@ SAMPLE_SIZE = 5
 CASE_SELECTION = "all"
 
 # ---------------- Helpers ---------------- #
-def ensure_columns(ws, required_cols):
-    """Ensure required columns exist in Note Activity sheet."""
-    headers = [cell.value for cell in ws[1]]
+def load_sheet_data(use_cache=True):
+    """Load acct_df/note_df and raw sheet rows, cached on the xlsx hash."""
+    with open(EXCEL_FILE, "rb") as f:
+        h = hashlib.sha1(f.read()).hexdigest()
+    mtime = os.path.getmtime(EXCEL_FILE)
+    acct_path = os.path.join(CACHE_DIR, f"{h}_acct.parquet")
+    note_path = os.path.join(CACHE_DIR, f"{h}_note.parquet")
+    rows_path = os.path.join(CACHE_DIR, f"{h}_rows.pkl")
+
+    if use_cache and os.path.exists(acct_path) and os.path.exists(note_path) and os.path.exists(rows_path):
+        with open(rows_path, "rb") as f:
+            cached_mtime, note_rows, acct_rows = pickle.load(f)
+        if cached_mtime == mtime:
+            logging.info("Cache hit: skipping workbook load")
+            return pd.read_parquet(acct_path), pd.read_parquet(note_path), note_rows, acct_rows
+
+    wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
+    if NOTE_SHEET not in wb.sheetnames or ACCOUNT_SHEET not in wb.sheetnames:
+        wb.close()
+        return None
+
+    note_rows = [row for row in wb[NOTE_SHEET].iter_rows(values_only=True)]
+    acct_rows = [row for row in wb[ACCOUNT_SHEET].iter_rows(values_only=True)]
+    wb.close()
+
+    acct_df = pd.read_excel(
+        EXCEL_FILE, sheet_name=ACCOUNT_SHEET, engine="calamine",
+        usecols=["Case", "Queue In Date"], dtype={"Case": "Int64"}
+    )
+    note_df = pd.read_excel(
+        EXCEL_FILE, sheet_name=NOTE_SHEET, engine="calamine",
+        usecols=["Case"], dtype={"Case": "Int64"}
+    )
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    acct_df.to_parquet(acct_path)
+    note_df.to_parquet(note_path)
+    with open(rows_path, "wb") as f:
+        pickle.dump((mtime, note_rows, acct_rows), f)
+
+    return acct_df, note_df, note_rows, acct_rows
+
+def ensure_columns(headers, required_cols):
+    """Ensure required columns exist in the Note Activity header row."""
+    headers = list(headers)
     for col in required_cols:
         if col not in headers:
-            ws.cell(row=1, column=len(headers)+1).value = col
             headers.append(col)
             logging.info(f"Added missing column: {col}")
     return headers
 
+CASE_RE = re.compile(r"case(\d+)", re.IGNORECASE)
+
+def get_case_from_filename(fname):
+    """Extract case number from jsonl filename like case4_xxx.jsonl."""
+    m = CASE_RE.search(fname)
+    return int(m.group(1)) if m else None
+
+def parse_jsonl_file(args):
+    """Parse one JSONL file into note records (worker-safe)."""
+    fpath, case_no, bias_name = args
+    records = []
+    with open(fpath, "rb") as f:
+        data = f.read()
+    for line in data.split(b"\n"):
+        if not line:
+            continue
+        try:
+            rec = orjson.loads(line)
+            note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
+            records.append({
+                "Case": case_no,
+                "example_id": rec.get("example_id", ""),
+                "Note": note_text,
+                "bias": bias_name
+            })
+        except Exception as e:
+            logging.warning(f"Failed parsing line in {os.path.basename(fpath)}: {e}")
+    return records
+
 def filter_cases(all_cases):
     """Filter cases based on CASE_SELECTION config."""
     if CASE_SELECTION == "all":
@@ -52,117 +129,152 @@ def filter_cases(all_cases):
         return []
 
 # ---------------- Main Logic ---------------- #
-def insert_notes():
-    logging.info("Loading workbook...")
-    wb = load_workbook(EXCEL_FILE)
-    if NOTE_SHEET not in wb.sheetnames or ACCOUNT_SHEET not in wb.sheetnames:
+def insert_notes(use_cache=True):
+    logging.info("Loading sheet data...")
+    sheet_data = load_sheet_data(use_cache=use_cache)
+    if sheet_data is None:
         logging.error("Excel file must contain 'Note Activity' and 'Account Activity' sheets.")
         return
-    ws_notes = wb[NOTE_SHEET]
+    acct_df, note_df, note_rows, acct_rows = sheet_data
+
+    data_rows = note_rows[1:]
 
     logging.info("Building case -> Queue In Date mapping...")
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
-    acct_df["Queue In Date"] = pd.to_datetime(acct_df["Queue In Date"], errors="coerce")
-    case_queue_dates = dict(zip(acct_df["Case"], acct_df["Queue In Date"]))
+    acct_df["Queue In Date"] = pd.to_datetime(
+        acct_df["Queue In Date"], format="%Y-%m-%d", errors="coerce", cache=True
+    )
+    queue_map = acct_df.dropna(subset=["Queue In Date"]).set_index("Case")["Queue In Date"]
 
     # Cases to process from Note Activity sheet
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
-    all_cases = note_df["Case"].dropna().unique().tolist()
-    all_cases = [int(c) for c in all_cases if str(c).isdigit()]
+    all_cases = (
+        pd.to_numeric(note_df["Case"], errors="coerce")
+        .dropna().astype("int64").unique().tolist()
+    )
 
     selected_cases = filter_cases(all_cases)
     logging.info(f"Processing cases: {selected_cases}")
 
+    # Vectorized queue-date lookup and target-date arithmetic, one pass
+    q_dates = queue_map.reindex(selected_cases)
+    for case_no in q_dates.index[q_dates.isna()]:
+        logging.warning(f"No Queue In Date for case {case_no}")
+    q_dates = q_dates.dropna()
+    target_dates = q_dates - pd.Timedelta(days=45)
+
     # Ensure extra columns
-    headers = ensure_columns(ws_notes, ["example_id", "bias"])
-    col_map = {h: headers.index(h)+1 for h in headers}  # header -> col index
-
-    # Iterate each case from Note Activity
-    for case_no in selected_cases:
-        q_date = case_queue_dates.get(case_no)
-        if pd.isna(q_date):
-            logging.warning(f"No Queue In Date for case {case_no}")
-            continue
+    headers = ensure_columns(note_rows[0] if note_rows else [], ["example_id", "bias"])
+    col_map = {h: i+1 for i, h in enumerate(headers)}  # header -> col index
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+    note_col = col_map["Note"] - 1
+    example_col = col_map["example_id"] - 1
+    bias_col = col_map["bias"] - 1
 
-        logging.info(f"Processing Case {case_no} with Queue In Date {q_date.date()}")
+    # New rows are collected here and merged in one sort before the write
+    pending = []
 
-        # Collect candidate records from JSONL files for this case
-        all_records = []
-        for bias_name in os.listdir(DATA_DIR):
-            subdir = os.path.join(DATA_DIR, bias_name)
-            if not os.path.isdir(subdir):
+    # Walk data_sub once, collecting (path, case, bias) parse tasks
+    selected_set = frozenset(target_dates.index)
+    tasks = []
+    with os.scandir(DATA_DIR) as it:
+        bias_dirs = [e for e in it if e.is_dir()]
+    for bias_dir in bias_dirs:
+        bias_name = bias_dir.name
+        with os.scandir(bias_dir.path) as sub_it:
+            jsonl_files = [e for e in sub_it if e.name.endswith(".jsonl")]
+        for entry in jsonl_files:
+            case_no = get_case_from_filename(entry.name)
+            if not case_no or case_no not in selected_set:
                 continue
-            for fname in os.listdir(subdir):
-                if not fname.endswith(".jsonl"):
-                    continue
-                if f"case{case_no}" not in fname.lower():
-                    continue
-                fpath = os.path.join(subdir, fname)
-                logging.info(f"Reading {fpath}")
-                with open(fpath, "r", encoding="utf-8") as f:
-                    for line in f:
-                        try:
-                            rec = json.loads(line)
-                            note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                            all_records.append({
-                                "Case": case_no,
-                                "example_id": rec.get("example_id", ""),
-                                "Note": note_text,
-                                "bias": bias_name
-                            })
-                        except Exception as e:
-                            logging.warning(f"Failed parsing line in {fname}: {e}")
-
-        if not all_records:
+            logging.info(f"Queueing {entry.path}")
+            tasks.append((entry.path, case_no, bias_name))
+
+    # One shared pool parses every file; the parent keeps the per-case
+    # reservoirs (Algorithm R) so sampling stays uniform and O(SAMPLE_SIZE)
+    seen_by_case = defaultdict(int)
+    records_by_case = defaultdict(list)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for records in ex.map(parse_jsonl_file, tasks, chunksize=8):
+            for record in records:
+                case_no = record["Case"]
+                seen = seen_by_case[case_no]
+                reservoir = records_by_case[case_no]
+                if seen < SAMPLE_SIZE:
+                    reservoir.append(record)
+                else:
+                    j = random.randint(0, seen)
+                    if j < SAMPLE_SIZE:
+                        reservoir[j] = record
+                seen_by_case[case_no] = seen + 1
+
+    # Phase (b): splice new notes into the in-memory row list
+    for case_no, target_date in target_dates.items():
+        logging.info(f"Processing Case {case_no} with Queue In Date {q_dates[case_no].date()}")
+
+        # Reservoir for this case from the single directory walk
+        subset = records_by_case.get(case_no, [])
+
+        if not subset:
             logging.info(f"No JSONL records found for Case {case_no}")
             continue
 
-        # Sample up to 5 records
-        subset = random.sample(all_records, min(SAMPLE_SIZE, len(all_records)))
         logging.info(f"Selected {len(subset)} records for Case {case_no}")
 
         # Target date = ~45 days before Queue In Date
-        target_date = q_date - timedelta(days=45)
         logging.info(f"Target Note Date for Case {case_no}: {target_date.date()}")
 
-        # Locate block of rows for this case in Note Activity
-        case_rows = [
-            (idx, ws_notes.cell(idx, col_map["Note Date"]).value)
-            for idx in range(2, ws_notes.max_row+1)
-            if ws_notes.cell(idx, col_map["Case"]).value == case_no
-        ]
-        if not case_rows:
-            logging.warning(f"No existing rows in Note Activity for Case {case_no}, appending at end")
-            case_rows = [(ws_notes.max_row+1, None)]
-
+        target_date_str = target_date.strftime("%Y-%m-%d")
         for rec in subset:
-            # Default insert after last row of this case
-            insert_at = case_rows[-1][0] + 1
-
-            # Search for the right position inside this case block
-            for idx, note_date in case_rows:
-                try:
-                    if pd.to_datetime(note_date) >= target_date:
-                        insert_at = idx
-                        break
-                except Exception:
-                    continue
-
-            logging.info(f"Inserting note for Case {case_no} at row {insert_at}")
-
-            # Insert new row
-            ws_notes.insert_rows(insert_at)
-            ws_notes.cell(insert_at, col_map["Case"]).value = case_no
-            ws_notes.cell(insert_at, col_map["Note Date"]).value = target_date.strftime("%Y-%m-%d")
-            ws_notes.cell(insert_at, col_map["Note"]).value = rec["Note"]
-            ws_notes.cell(insert_at, col_map["example_id"]).value = rec["example_id"]
-            ws_notes.cell(insert_at, col_map["bias"]).value = rec["bias"]
-
-            logging.debug(f"Inserted record: {rec}")
-
-    wb.save(EXCEL_FILE)
+            new_row = [None] * len(headers)
+            new_row[case_col] = case_no
+            new_row[date_col] = target_date_str
+            new_row[note_col] = rec["Note"]
+            new_row[example_col] = rec["example_id"]
+            new_row[bias_col] = rec["bias"]
+            pending.append(tuple(new_row))
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Queued record: {rec}")
+
+        logging.info(f"Queued {len(subset)} notes for case {case_no}")
+
+    # Phase (c): one bulk merge + sort, then a single sequential write
+    all_rows = data_rows + pending
+    # Typed sort keys, vector-parsed once per column: string keys would
+    # put case 10 before case 2 and order existing datetime cells
+    # against the new YYYY-MM-DD strings incoherently. Unparseable
+    # cases and dates sort last.
+    case_keys = pd.to_numeric(
+        pd.Series([r[case_col] for r in all_rows]), errors="coerce"
+    ).fillna(float("inf")).tolist()
+    date_keys = pd.to_datetime(
+        pd.Series([r[date_col] for r in all_rows]), errors="coerce"
+    ).fillna(pd.Timestamp.max).tolist()
+    order = sorted(range(len(all_rows)), key=lambda i: (case_keys[i], date_keys[i]))
+    all_rows = [all_rows[i] for i in order]
+    logging.info(f"Merged {len(pending)} new notes into {len(all_rows)} rows")
+
+    out_wb = xlsxwriter.Workbook(EXCEL_FILE, {
+        "constant_memory": True,
+        # Preserved datetime cells must render as dates, not raw
+        # Excel serials — the next run re-parses Queue In Date
+        "default_date_format": "yyyy-mm-dd",
+        "remove_timezone": True,
+    })
+    ws_notes = out_wb.add_worksheet(NOTE_SHEET)
+    ws_notes.write_row(0, 0, headers)
+    for r, row in enumerate(all_rows, start=1):
+        ws_notes.write_row(r, 0, row)
+    ws_acct = out_wb.add_worksheet(ACCOUNT_SHEET)
+    for r, row in enumerate(acct_rows):
+        ws_acct.write_row(r, 0, row)
+    out_wb.close()
     logging.info(f"Workbook updated: {EXCEL_FILE}")
 
 # ---------------- Run ---------------- #
 if __name__ == "__main__":
-    insert_notes()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached workbook parse results")
+    args = parser.parse_args()
+    insert_notes(use_cache=not args.no_cache)
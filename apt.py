@@ -1,11 +1,15 @@
 import os
-import json
+import re
+import orjson
 import random
 import logging
-from datetime import timedelta
+import argparse
+import hashlib
+import pickle
+import numpy as np
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
 
 # ---------------- Logging ---------------- #
 logging.basicConfig(
@@ -21,108 +25,194 @@ NOTE_SHEET = "Note Activity"
 ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
+CACHE_DIR = ".cache"
 
 # ---------------- Helpers ---------------- #
-def ensure_columns(ws, required_cols):
-    """Ensure required columns exist in Note Activity sheet."""
-    headers = [cell.value for cell in ws[1]]
+def ensure_columns(headers, required_cols):
+    """Ensure required columns exist in the Note Activity header row."""
+    headers = list(headers)
     for col in required_cols:
         if col not in headers:
-            ws.cell(row=1, column=len(headers)+1).value = col
             headers.append(col)
     return headers
 
+CASE_RE = re.compile(r"case(\d+)", re.IGNORECASE)
+
 def get_case_from_filename(fname):
     """Extract case number from jsonl filename like case4_xxx.jsonl."""
-    for part in fname.replace(".jsonl", "").split("_"):
-        if part.lower().startswith("case"):
-            return int(part.lower().replace("case", ""))
-    return None
+    m = CASE_RE.search(fname)
+    return int(m.group(1)) if m else None
+
+def load_sheet_data(use_cache=True):
+    """Load acct_df and raw sheet rows, cached on the xlsx hash."""
+    with open(EXCEL_FILE, "rb") as f:
+        h = hashlib.sha1(f.read()).hexdigest()
+    mtime = os.path.getmtime(EXCEL_FILE)
+    acct_path = os.path.join(CACHE_DIR, f"{h}_acct.parquet")
+    rows_path = os.path.join(CACHE_DIR, f"{h}_rows.pkl")
+
+    if use_cache and os.path.exists(acct_path) and os.path.exists(rows_path):
+        with open(rows_path, "rb") as f:
+            cached_mtime, note_rows, acct_rows = pickle.load(f)
+        if cached_mtime == mtime:
+            logging.info("Cache hit: skipping workbook load")
+            return pd.read_parquet(acct_path), note_rows, acct_rows
+
+    wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
+    if NOTE_SHEET not in wb.sheetnames or ACCOUNT_SHEET not in wb.sheetnames:
+        wb.close()
+        return None
+
+    note_rows = [row for row in wb[NOTE_SHEET].iter_rows(values_only=True)]
+    acct_rows = [row for row in wb[ACCOUNT_SHEET].iter_rows(values_only=True)]
+    wb.close()
+
+    acct_df = pd.read_excel(
+        EXCEL_FILE, sheet_name=ACCOUNT_SHEET, engine="calamine",
+        usecols=["Case", "Queue In Date"], dtype={"Case": "Int64"}
+    )
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    acct_df.to_parquet(acct_path)
+    with open(rows_path, "wb") as f:
+        pickle.dump((mtime, note_rows, acct_rows), f)
+
+    return acct_df, note_rows, acct_rows
 
 # ---------------- Main Logic ---------------- #
-def insert_notes():
-    # Load workbook
-    wb = load_workbook(EXCEL_FILE)
-    if NOTE_SHEET not in wb.sheetnames or ACCOUNT_SHEET not in wb.sheetnames:
+def insert_notes(use_cache=True):
+    sheet_data = load_sheet_data(use_cache=use_cache)
+    if sheet_data is None:
         logging.error("Excel file must contain 'Note Activity' and 'Account Activity' sheets.")
         return
-    ws_notes = wb[NOTE_SHEET]
-    ws_acct = wb[ACCOUNT_SHEET]
+    acct_df, note_rows, acct_rows = sheet_data
 
-    # Build case -> Queue In Date lookup
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
-    acct_df["Queue In Date"] = pd.to_datetime(acct_df["Queue In Date"], errors="coerce")
-    case_queue_dates = dict(zip(acct_df["Case"], acct_df["Queue In Date"]))
+    data_rows = note_rows[1:]
 
-    # Ensure extra columns
-    headers = ensure_columns(ws_notes, ["example_id", "bias"])
-    col_map = {h: headers.index(h)+1 for h in headers}  # header -> col index
-
-    # Iterate over subdirectories (bias)
-    for bias_name in os.listdir(DATA_DIR):
-        subdir = os.path.join(DATA_DIR, bias_name)
-        if not os.path.isdir(subdir):
-            continue
+    # Build case -> target Note Date lookup as numpy datetime64 days;
+    # the 45-day shift happens once, in C, instead of per record
+    acct_df["Queue In Date"] = pd.to_datetime(
+        acct_df["Queue In Date"], format="%Y-%m-%d", errors="coerce", cache=True
+    )
+    cases_arr = acct_df["Case"].to_numpy()
+    target_arr = acct_df["Queue In Date"].values.astype("datetime64[D]") - np.timedelta64(45, "D")
+    target_map = dict(zip(cases_arr.tolist(), target_arr))
 
-        all_records = []
-        for fname in os.listdir(subdir):
-            if not fname.endswith(".jsonl"):
-                continue
+    # Ensure extra columns
+    headers = ensure_columns(note_rows[0] if note_rows else [], ["example_id", "bias"])
+    col_map = {h: i+1 for i, h in enumerate(headers)}  # header -> col index
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+    note_col = col_map["Note"] - 1
+    example_col = col_map["example_id"] - 1
+    bias_col = col_map["bias"] - 1
+
+    # New rows are collected here and merged in one sort before the write
+    pending = []
+
+    # Iterate over subdirectories (bias), queueing new notes
+    with os.scandir(DATA_DIR) as it:
+        bias_dirs = [e for e in it if e.is_dir()]
+    for bias_dir in bias_dirs:
+        bias_name = bias_dir.name
+
+        # Reservoir (Algorithm R): keep a uniform SAMPLE_SIZE sample per bias
+        reservoir = []
+        seen = 0
+        with os.scandir(bias_dir.path) as sub_it:
+            jsonl_files = [e for e in sub_it if e.name.endswith(".jsonl")]
+        for entry in jsonl_files:
+            fname = entry.name
             case_no = get_case_from_filename(fname)
             if not case_no:
                 continue
-            fpath = os.path.join(subdir, fname)
-            with open(fpath, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                        all_records.append({
-                            "Case": case_no,
-                            "example_id": rec.get("example_id", ""),
-                            "Note": note_text,
-                            "bias": bias_name
-                        })
-                    except Exception as e:
-                        logging.warning(f"Failed parsing line in {fname}: {e}")
-
-        if not all_records:
+            fpath = entry.path
+            with open(fpath, "rb") as f:
+                data = f.read()
+            for line in data.split(b"\n"):
+                if not line:
+                    continue
+                try:
+                    rec = orjson.loads(line)
+                    note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
+                    record = {
+                        "Case": case_no,
+                        "example_id": rec.get("example_id", ""),
+                        "Note": note_text,
+                        "bias": bias_name
+                    }
+                    if seen < SAMPLE_SIZE:
+                        reservoir.append(record)
+                    else:
+                        j = random.randint(0, seen)
+                        if j < SAMPLE_SIZE:
+                            reservoir[j] = record
+                    seen += 1
+                except Exception as e:
+                    logging.warning(f"Failed parsing line in {fname}: {e}")
+
+        if not reservoir:
             continue
 
-        # Sample 5 records
-        subset = random.sample(all_records, min(SAMPLE_SIZE, len(all_records)))
+        subset = reservoir
 
         for rec in subset:
             case_no = rec["Case"]
-            q_date = case_queue_dates.get(case_no)
-            if pd.isna(q_date):
+            target_date = target_map.get(case_no)
+            if target_date is None or np.isnat(target_date):
                 logging.warning(f"No Queue In Date for case {case_no}")
                 continue
-            target_date = q_date - timedelta(days=45)  # ~midpoint of 3 months back
-
-            # Find insertion row (keep sorted by Note Date)
-            note_dates = [cell.value for cell in ws_notes["B"][1:]]  # column B = Note Date (skip header)
-            insert_at = ws_notes.max_row + 1
-            for idx, val in enumerate(note_dates, start=2):
-                try:
-                    if pd.to_datetime(val) >= target_date:
-                        insert_at = idx
-                        break
-                except Exception:
-                    continue
-
-            ws_notes.insert_rows(insert_at)
-            ws_notes.cell(insert_at, col_map["Case"]).value = case_no
-            ws_notes.cell(insert_at, col_map["Note Date"]).value = target_date.strftime("%Y-%m-%d")
-            ws_notes.cell(insert_at, col_map["Note"]).value = rec["Note"]
-            ws_notes.cell(insert_at, col_map["example_id"]).value = rec["example_id"]
-            ws_notes.cell(insert_at, col_map["bias"]).value = rec["bias"]
-
-            logging.info(f"Inserted note for Case {case_no} (bias={rec['bias']}) at row {insert_at}")
 
-    wb.save(EXCEL_FILE)
+            new_row = [None] * len(headers)
+            new_row[case_col] = case_no
+            new_row[date_col] = str(target_date)  # datetime64[D] renders as YYYY-MM-DD
+            new_row[note_col] = rec["Note"]
+            new_row[example_col] = rec["example_id"]
+            new_row[bias_col] = rec["bias"]
+            pending.append(tuple(new_row))
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Queued note for Case {case_no} (bias={rec['bias']})")
+
+        logging.info(f"Queued {len(subset)} notes for bias={bias_name}")
+
+    # One bulk merge + sort, then a single sequential write
+    all_rows = data_rows + pending
+    # Typed sort keys, vector-parsed once per column: string keys would
+    # put case 10 before case 2 and order existing datetime cells
+    # against the new YYYY-MM-DD strings incoherently. Unparseable
+    # cases and dates sort last.
+    case_keys = pd.to_numeric(
+        pd.Series([r[case_col] for r in all_rows]), errors="coerce"
+    ).fillna(float("inf")).tolist()
+    date_keys = pd.to_datetime(
+        pd.Series([r[date_col] for r in all_rows]), errors="coerce"
+    ).fillna(pd.Timestamp.max).tolist()
+    order = sorted(range(len(all_rows)), key=lambda i: (case_keys[i], date_keys[i]))
+    all_rows = [all_rows[i] for i in order]
+    logging.info(f"Merged {len(pending)} new notes into {len(all_rows)} rows")
+
+    out_wb = xlsxwriter.Workbook(EXCEL_FILE, {
+        "constant_memory": True,
+        # Preserved datetime cells must render as dates, not raw
+        # Excel serials — the next run re-parses Queue In Date
+        "default_date_format": "yyyy-mm-dd",
+        "remove_timezone": True,
+    })
+    ws_notes = out_wb.add_worksheet(NOTE_SHEET)
+    ws_notes.write_row(0, 0, headers)
+    for r, row in enumerate(all_rows, start=1):
+        ws_notes.write_row(r, 0, row)
+    ws_acct = out_wb.add_worksheet(ACCOUNT_SHEET)
+    for r, row in enumerate(acct_rows):
+        ws_acct.write_row(r, 0, row)
+    out_wb.close()
     logging.info(f"Workbook updated: {EXCEL_FILE}")
 
 # ---------------- Run ---------------- #
 if __name__ == "__main__":
-    insert_notes()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached workbook parse results")
+    args = parser.parse_args()
+    insert_notes(use_cache=not args.no_cache)
@@ -1,9 +1,14 @@
 import os
-import json
+import orjson
 import random
 import logging
-from datetime import timedelta
+import argparse
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook
 
 # ---------------- Logging ---------------- #
@@ -20,6 +25,7 @@ NOTE_SHEET = "Note Activity"
 ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
+CACHE_DIR = ".cache"
 
 # ---- Case selection ----
 # CASE_SELECTION = "all"   # all cases
@@ -28,12 +34,11 @@ SAMPLE_SIZE = 5
 CASE_SELECTION = "all"
 
 # ---------------- Helpers ---------------- #
-def ensure_columns(ws, required_cols):
-    """Ensure required columns exist in Note Activity sheet."""
-    headers = [cell.value for cell in ws[1]]
+def ensure_columns(headers, required_cols):
+    """Ensure required columns exist in the Note Activity header row."""
+    headers = list(headers)
     for col in required_cols:
         if col not in headers:
-            ws.cell(row=1, column=len(headers)+1).value = col
             headers.append(col)
             logging.info(f"Added missing column: {col}")
     return headers
@@ -51,89 +56,164 @@ def filter_cases(all_cases):
         logging.error("Invalid CASE_SELECTION format.")
         return []
 
+def parse_subdir(bias_name):
+    """Parse every JSONL file in one bias subdirectory (worker-safe)."""
+    subdir = os.path.join(DATA_DIR, bias_name)
+    records = []
+    with os.scandir(subdir) as it:
+        jsonl_files = [e for e in it if e.name.endswith(".jsonl")]
+    for entry in jsonl_files:
+        fname = entry.name
+        fpath = entry.path
+        logging.info(f"Reading {fpath}")
+        with open(fpath, "rb") as f:
+            data = f.read()
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            try:
+                rec = orjson.loads(line)
+                note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
+                records.append({
+                    "example_id": rec.get("example_id", ""),
+                    "Note": note_text,
+                    "bias": bias_name
+                })
+            except Exception as e:
+                logging.warning(f"Failed parsing line in {fname}: {e}")
+    return records
+
 def load_bias_records():
-    """Load all records grouped by bias (cache for sampling)."""
+    """Load all records grouped by bias (cache for sampling), one worker per subdir."""
+    with os.scandir(DATA_DIR) as it:
+        bias_dirs = [e.name for e in it if e.is_dir()]
     bias_records = {}
-    for bias_name in os.listdir(DATA_DIR):
-        subdir = os.path.join(DATA_DIR, bias_name)
-        if not os.path.isdir(subdir):
-            continue
-
-        records = []
-        for fname in os.listdir(subdir):
-            if not fname.endswith(".jsonl"):
-                continue
-            fpath = os.path.join(subdir, fname)
-            logging.info(f"Reading {fpath}")
-            with open(fpath, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                        records.append({
-                            "example_id": rec.get("example_id", ""),
-                            "Note": note_text,
-                            "bias": bias_name
-                        })
-                    except Exception as e:
-                        logging.warning(f"Failed parsing line in {fname}: {e}")
-
-        if records:
-            bias_records[bias_name] = records
-            logging.info(f"Loaded {len(records)} records for bias={bias_name}")
-        else:
-            logging.warning(f"No records found in {subdir}")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for bias_name, records in zip(bias_dirs, ex.map(parse_subdir, bias_dirs)):
+            if records:
+                bias_records[bias_name] = records
+                logging.info(f"Loaded {len(records)} records for bias={bias_name}")
+            else:
+                logging.warning(f"No records found in {os.path.join(DATA_DIR, bias_name)}")
 
     return bias_records
 
-# ---------------- Main Logic ---------------- #
-def insert_notes():
-    logging.info("Loading workbook...")
-    wb = load_workbook(EXCEL_FILE)
+def load_sheet_data(use_cache=True):
+    """Load acct_df/note_df and raw sheet rows, cached on the xlsx hash."""
+    with open(EXCEL_FILE, "rb") as f:
+        h = hashlib.sha1(f.read()).hexdigest()
+    mtime = os.path.getmtime(EXCEL_FILE)
+    acct_path = os.path.join(CACHE_DIR, f"{h}_acct.parquet")
+    note_path = os.path.join(CACHE_DIR, f"{h}_note.parquet")
+    rows_path = os.path.join(CACHE_DIR, f"{h}_rows.pkl")
+
+    if use_cache and os.path.exists(acct_path) and os.path.exists(note_path) and os.path.exists(rows_path):
+        with open(rows_path, "rb") as f:
+            cached_mtime, note_rows, acct_rows = pickle.load(f)
+        if cached_mtime == mtime:
+            logging.info("Cache hit: skipping workbook load")
+            return pd.read_parquet(acct_path), pd.read_parquet(note_path), note_rows, acct_rows
+
+    wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
     if NOTE_SHEET not in wb.sheetnames or ACCOUNT_SHEET not in wb.sheetnames:
+        wb.close()
+        return None
+
+    note_rows = [row for row in wb[NOTE_SHEET].iter_rows(values_only=True)]
+    acct_rows = [row for row in wb[ACCOUNT_SHEET].iter_rows(values_only=True)]
+    wb.close()
+
+    acct_df = pd.read_excel(
+        EXCEL_FILE, sheet_name=ACCOUNT_SHEET, engine="calamine",
+        usecols=["Case", "Queue In Date"], dtype={"Case": "Int64"}
+    )
+    note_df = pd.read_excel(
+        EXCEL_FILE, sheet_name=NOTE_SHEET, engine="calamine",
+        usecols=["Case"], dtype={"Case": "Int64"}
+    )
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    acct_df.to_parquet(acct_path)
+    note_df.to_parquet(note_path)
+    with open(rows_path, "wb") as f:
+        pickle.dump((mtime, note_rows, acct_rows), f)
+
+    return acct_df, note_df, note_rows, acct_rows
+
+# ---------------- Main Logic ---------------- #
+def insert_notes(use_cache=True):
+    logging.info("Loading sheet data...")
+    sheet_data = load_sheet_data(use_cache=use_cache)
+    if sheet_data is None:
         logging.error("Excel file must contain 'Note Activity' and 'Account Activity' sheets.")
         return
-    ws_notes = wb[NOTE_SHEET]
+    acct_df, note_df, note_rows, acct_rows = sheet_data
+
+    data_rows = note_rows[1:]
 
     logging.info("Building case -> Queue In Date mapping...")
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
-    acct_df["Queue In Date"] = pd.to_datetime(acct_df["Queue In Date"], errors="coerce")
-    case_queue_dates = dict(zip(acct_df["Case"], acct_df["Queue In Date"]))
+    acct_df["Queue In Date"] = pd.to_datetime(
+        acct_df["Queue In Date"], format="%Y-%m-%d", errors="coerce", cache=True
+    )
+    queue_map = acct_df.dropna(subset=["Queue In Date"]).set_index("Case")["Queue In Date"]
 
     # Cases to process from Note Activity sheet
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
-    all_cases = note_df["Case"].dropna().unique().tolist()
-    all_cases = [int(c) for c in all_cases if str(c).isdigit()]
+    all_cases = (
+        pd.to_numeric(note_df["Case"], errors="coerce")
+        .dropna().astype("int64").unique().tolist()
+    )
 
     selected_cases = filter_cases(all_cases)
     logging.info(f"Processing cases: {selected_cases}")
 
+    # Vectorized queue-date lookup and target-date arithmetic, one pass
+    q_dates = queue_map.reindex(selected_cases)
+    for case_no in q_dates.index[q_dates.isna()]:
+        logging.warning(f"No Queue In Date for case {case_no}")
+    q_dates = q_dates.dropna()
+    target_dates = q_dates - pd.Timedelta(days=45)
+
     # Ensure extra columns
-    headers = ensure_columns(ws_notes, ["example_id", "bias"])
-    col_map = {h: headers.index(h)+1 for h in headers}  # header -> col index
+    headers = ensure_columns(note_rows[0] if note_rows else [], ["example_id", "bias"])
+    col_map = {h: i+1 for i, h in enumerate(headers)}  # header -> col index
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+    note_col = col_map["Note"] - 1
+    example_col = col_map["example_id"] - 1
+    bias_col = col_map["bias"] - 1
+
+    # One pass over the cached rows: bucket (row index, note date) by case
+    rows_by_case = {}
+    for idx, row in enumerate(data_rows):
+        rows_by_case.setdefault(row[case_col], []).append((idx, row[date_col]))
 
     # Load all bias records once
     bias_records = load_bias_records()
 
-    # Iterate each case from Note Activity
-    for case_no in selected_cases:
-        q_date = case_queue_dates.get(case_no)
-        if pd.isna(q_date):
-            logging.warning(f"No Queue In Date for case {case_no}")
-            continue
+    # New rows are collected as (original row index, row) pairs and
+    # merged in one pass at the end — splicing into data_rows here
+    # would shift the cached rows_by_case indices for every later case
+    pending = []
 
-        target_date = q_date - timedelta(days=45)
+    # Iterate each case from Note Activity, queueing new notes
+    for case_no, target_date in target_dates.items():
         logging.info(f"Target Note Date for Case {case_no}: {target_date.date()}")
 
-        # Locate block of rows for this case in Note Activity
-        case_rows = [
-            (idx, ws_notes.cell(idx, col_map["Note Date"]).value)
-            for idx in range(2, ws_notes.max_row+1)
-            if ws_notes.cell(idx, col_map["Case"]).value == case_no
-        ]
+        # Locate block of rows for this case in the cached row list
+        case_rows = rows_by_case.get(case_no, [])
         if not case_rows:
             logging.warning(f"No existing rows for Case {case_no}, appending at end")
-            case_rows = [(ws_notes.max_row+1, None)]
+            case_rows = [(len(data_rows), None)]
+
+        # Parse the block's dates once; vectorized first-match replaces
+        # the per-record scan. The block stays in raw sheet order and
+        # may hold NaT, so bisecting it is off the table — NaT never
+        # passes the comparison, matching the old linear scan.
+        dates_np = pd.to_datetime([d for _, d in case_rows], errors="coerce").to_numpy()
+        hits = np.flatnonzero(dates_np >= np.datetime64(target_date))
+        insert_at = case_rows[int(hits[0])][0] if hits.size else case_rows[-1][0] + 1
+        target_date_str = target_date.strftime("%Y-%m-%d")
 
         # Insert subset notes for each bias, fresh per case
         for bias_name, records in bias_records.items():
@@ -143,32 +223,51 @@ def insert_notes():
             logging.info(f"Inserting {len(subset)} notes for Case {case_no}, Bias={bias_name}")
 
             for rec in subset:
-                # Default insert after last row of this case
-                insert_at = case_rows[-1][0] + 1
-
-                # Find right place inside this case block
-                for idx, note_date in case_rows:
-                    try:
-                        if pd.to_datetime(note_date) >= target_date:
-                            insert_at = idx
-                            break
-                    except Exception:
-                        continue
-
-                logging.info(f"Inserting note for Case {case_no}, bias={bias_name} at row {insert_at}")
-
-                ws_notes.insert_rows(insert_at)
-                ws_notes.cell(insert_at, col_map["Case"]).value = case_no
-                ws_notes.cell(insert_at, col_map["Note Date"]).value = target_date.strftime("%Y-%m-%d")
-                ws_notes.cell(insert_at, col_map["Note"]).value = rec["Note"]
-                ws_notes.cell(insert_at, col_map["example_id"]).value = rec["example_id"]
-                ws_notes.cell(insert_at, col_map["bias"]).value = rec["bias"]
-
-                logging.debug(f"Inserted record: {rec}")
-
-    wb.save(EXCEL_FILE)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Queued note for Case {case_no}, bias={bias_name} at row {insert_at + 2}")
+
+                new_row = [None] * len(headers)
+                new_row[case_col] = case_no
+                new_row[date_col] = target_date_str
+                new_row[note_col] = rec["Note"]
+                new_row[example_col] = rec["example_id"]
+                new_row[bias_col] = rec["bias"]
+                pending.append((insert_at, tuple(new_row)))
+
+    # One stable merge pass against the original indices: every queued
+    # row lands above the row it was aimed at, regardless of how many
+    # rows earlier cases added
+    pending.sort(key=lambda pair: pair[0])
+    merged_rows = []
+    p_i = 0
+    for idx, row in enumerate(data_rows):
+        while p_i < len(pending) and pending[p_i][0] <= idx:
+            merged_rows.append(pending[p_i][1])
+            p_i += 1
+        merged_rows.append(row)
+    merged_rows.extend(row for _, row in pending[p_i:])
+
+    # Emit everything through xlsxwriter in constant-memory mode
+    out_wb = xlsxwriter.Workbook(EXCEL_FILE, {
+        "constant_memory": True,
+        # Preserved datetime cells must render as dates, not raw
+        # Excel serials — the next run re-parses Queue In Date
+        "default_date_format": "yyyy-mm-dd",
+        "remove_timezone": True,
+    })
+    ws_notes = out_wb.add_worksheet(NOTE_SHEET)
+    ws_notes.write_row(0, 0, headers)
+    for r, row in enumerate(merged_rows, start=1):
+        ws_notes.write_row(r, 0, row)
+    ws_acct = out_wb.add_worksheet(ACCOUNT_SHEET)
+    for r, row in enumerate(acct_rows):
+        ws_acct.write_row(r, 0, row)
+    out_wb.close()
     logging.info(f"Workbook updated: {EXCEL_FILE}")
 
 # ---------------- Run ---------------- #
 if __name__ == "__main__":
-    insert_notes()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached workbook parse results")
+    args = parser.parse_args()
+    insert_notes(use_cache=not args.no_cache)
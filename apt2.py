@@ -1,10 +1,20 @@
 import os
-import json
+import sys
+import orjson
 import random
+import bisect
+import zipfile
+import argparse
+import multiprocessing
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
 import logging
 from datetime import datetime
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import load_workbook, Workbook
 
 # ---------------- Logging ---------------- #
 logging.basicConfig(
@@ -21,6 +31,7 @@ ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
 OUTPUT_DIR = "case_variants"
+CACHE_DIR = ".cache"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ---- Case selection ----
@@ -31,13 +42,12 @@ CASE_SELECTION = "all"
 
 
 # ---------------- Helpers ---------------- #
-def ensure_columns(ws):
+def ensure_columns(headers):
     """Ensure required columns exist in Note Activity sheet (except Note)."""
-    headers = [cell.value for cell in ws[1]]
+    headers = list(headers)
     required_cols = ["example_id", "bias"]
     for col in required_cols:
         if col not in headers:
-            ws.cell(row=1, column=len(headers)+1).value = col
             headers.append(col)
             logging.info(f"Added missing column: {col}")
     return headers
@@ -57,7 +67,32 @@ def filter_cases(all_cases):
         return []
 
 
-def load_bias_records():
+# Bias name lives on the outer dict key, so records only carry
+# (example_id, note); a namedtuple is far smaller than a per-record dict
+BiasRecord = namedtuple("BiasRecord", ["example_id", "note"])
+
+def iter_jsonl_fast(path, block_size=1 << 20):
+    """Yield raw jsonl lines from os.read blocks, scanning with bytes.find."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        buf = bytearray()
+        while True:
+            block = os.read(fd, block_size)
+            if not block:
+                break
+            buf += block
+            start = 0
+            while (nl := buf.find(b"\n", start)) != -1:
+                yield bytes(buf[start:nl])
+                start = nl + 1
+            del buf[:start]
+        if buf:
+            yield bytes(buf)
+    finally:
+        os.close(fd)
+
+
+def load_bias_records(use_cache=True):
     """Load all records grouped by bias (cache for sampling)."""
     bias_records = {}
     for bias_name in os.listdir(DATA_DIR):
@@ -65,116 +100,215 @@ def load_bias_records():
         if not os.path.isdir(subdir):
             continue
 
+        fpaths = [
+            os.path.join(subdir, fname)
+            for fname in os.listdir(subdir) if fname.endswith(".jsonl")
+        ]
+        if not fpaths:
+            logging.warning(f"No records found in {subdir}")
+            continue
+
+        # Parsed shards are cached as Parquet keyed on the newest jsonl mtime
+        cache_key = int(max(os.path.getmtime(p) for p in fpaths))
+        cache_path = os.path.join(CACHE_DIR, f"{bias_name}_{cache_key}.parquet")
+        if use_cache and os.path.exists(cache_path):
+            logging.info(f"Cache hit for bias={bias_name}")
+            bias_records[bias_name] = [
+                BiasRecord(d["example_id"], d["note"])
+                for d in pq.read_table(cache_path).to_pylist()
+            ]
+            continue
+
         records = []
-        for fname in os.listdir(subdir):
-            if not fname.endswith(".jsonl"):
-                continue
-            fpath = os.path.join(subdir, fname)
+        for fpath in fpaths:
             logging.info(f"Reading {fpath}")
-            with open(fpath, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                        records.append({
-                            "example_id": rec.get("example_id", ""),
-                            "Note": note_text,
-                            "bias": bias_name
-                        })
-                    except Exception as e:
-                        logging.warning(f"Failed parsing line in {fname}: {e}")
+            for line in iter_jsonl_fast(fpath):
+                if not line:
+                    continue
+                try:
+                    rec = orjson.loads(line)
+                    note_text = " ".join((rec.get("context", ""), rec.get("question", ""))).strip()
+                    example_id = rec.get("example_id", "")
+                    if isinstance(example_id, str):
+                        example_id = sys.intern(example_id)
+                    records.append(BiasRecord(example_id, note_text))
+                except Exception as e:
+                    logging.warning(f"Failed parsing line in {os.path.basename(fpath)}: {e}")
 
         if records:
             bias_records[bias_name] = records
             logging.info(f"Loaded {len(records)} records for bias={bias_name}")
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            pq.write_table(
+                pa.Table.from_pylist([r._asdict() for r in records]),
+                tmp_path, compression="zstd"
+            )
+            os.replace(tmp_path, cache_path)  # atomic flush
         else:
             logging.warning(f"No records found in {subdir}")
 
     return bias_records
 
 
-def get_case_block(note_df, case_no):
-    """Get subset of Note Activity rows for a specific case."""
-    case_block = note_df[note_df["Case"] == case_no].copy()
-    case_block["Note Date"] = pd.to_datetime(case_block["Note Date"], errors="coerce")
-    case_block = case_block.sort_values("Note Date")
-    return case_block
+def load_notes_stream(path, sheet):
+    """Stream one sheet in read-only mode -> (headers, list of row lists)."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    ws = wb[sheet]
+    rows_iter = ws.iter_rows(values_only=True)
+    headers = list(next(rows_iter))
+    rows = [list(row) for row in rows_iter]
+    wb.close()
+    return headers, rows
 
 
-def pick_insertion_date(case_block):
+def pick_insertion_date(dates):
     """Pick a reference date for new note (median of existing Note Dates)."""
-    if case_block.empty or case_block["Note Date"].isna().all():
+    valid_dates = sorted(d for d in dates if pd.notna(d))
+    if not valid_dates:
         return datetime.today()
-    valid_dates = case_block["Note Date"].dropna().sort_values()
-    return valid_dates.iloc[len(valid_dates)//2]  # median
+    return valid_dates[len(valid_dates)//2]  # median
+
+
+@contextmanager
+def fast_zip_saves(level=1):
+    """Temporarily default ZipFile to light compression for bulk saves."""
+    orig = zipfile.ZipFile
+
+    def patched(*args, **kwargs):
+        kwargs.setdefault("compresslevel", level)
+        return orig(*args, **kwargs)
+
+    zipfile.ZipFile = patched
+    try:
+        yield
+    finally:
+        zipfile.ZipFile = orig
+
+
+def emit_variant(out_path, headers, base_rows, insert_idx, new_row):
+    """Stream one spliced snapshot into a fresh write-only workbook."""
+    out_wb = Workbook(write_only=True)
+    out_ws = out_wb.create_sheet(NOTE_SHEET)
+    out_ws.append(headers)
+    for row in islice(base_rows, insert_idx):
+        out_ws.append(row)
+    out_ws.append(new_row)
+    for row in islice(base_rows, insert_idx, None):
+        out_ws.append(row)
+    with fast_zip_saves():
+        out_wb.save(out_path)
+
+
+# Read-only state shared with pool workers, set once per worker
+_worker = {}
+
+def _init_worker(bias_records, headers, col_map, base_rows, case_positions):
+    _worker.update(
+        bias_records=bias_records,
+        headers=headers,
+        col_map=col_map,
+        base_rows=base_rows,
+        case_positions=case_positions,
+    )
+
+
+def process_case(args):
+    """Generate and write every variant file for one case (worker-safe)."""
+    case_no, insert_date = args
+    bias_records = _worker["bias_records"]
+    headers = _worker["headers"]
+    col_map = _worker["col_map"]
+    base_rows = _worker["base_rows"]
+    positions = _worker["case_positions"].get(case_no, [])
+
+    random.seed(os.getpid() ^ case_no)
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+
+    # Same date for every variant of this case: format it once
+    insert_date_str = insert_date.strftime("%Y-%m-%d")
+
+    written = 0
+    for bias_name, records in bias_records.items():
+        if not records:
+            continue
 
+        # Sample 5 records for this bias and case
+        subset = random.sample(records, min(SAMPLE_SIZE, len(records)))
+        logging.info(f"Case {case_no}, Bias {bias_name}: {len(subset)} samples")
 
-# ---------------- Main Logic ---------------- #
-def create_case_variants():
-    logging.info("Loading workbook for case list...")
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
+        for idx, rec in enumerate(subset, start=1):
+            # Binary search over the case's pre-sorted (date, row idx) pairs
+            p = bisect.bisect_left(positions, (insert_date,))
+            insert_idx = positions[p][1] if p < len(positions) else len(base_rows)
+
+            new_row = [None] * len(headers)
+            new_row[case_col] = case_no
+            new_row[date_col] = insert_date_str
+            new_row[col_map["Note"] - 1] = rec.note
+            new_row[col_map["example_id"] - 1] = rec.example_id
+            new_row[col_map["bias"] - 1] = bias_name
+
+            out_name = f"Case{case_no}_Bias{bias_name}_Variant{idx}.xlsx"
+            out_path = os.path.join(OUTPUT_DIR, out_name)
+            emit_variant(out_path, headers, base_rows, insert_idx, new_row)
+            written += 1
 
-    all_cases = note_df["Case"].dropna().unique().tolist()
-    all_cases = [int(c) for c in all_cases if str(c).isdigit()]
+    return written
+
+
+# ---------------- Main Logic ---------------- #
+def create_case_variants(use_cache=True):
+    # Stream the Note Activity sheet ONCE; everything else derives from it
+    logging.info("Loading workbook...")
+    raw_headers, base_rows = load_notes_stream(EXCEL_FILE, NOTE_SHEET)
+    headers = ensure_columns(raw_headers)
+    col_map = {h: headers.index(h)+1 for h in headers}
+    base_rows = [row + [None] * (len(headers) - len(row)) for row in base_rows]
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+
+    # Parse the date column once, vectorized, and bucket dates by case.
+    # case_positions holds sorted (date, row idx) pairs for bisecting.
+    note_dates = pd.to_datetime([row[date_col] for row in base_rows], errors="coerce")
+    dates_by_case = {}
+    case_positions = {}
+    for idx, (row, note_date) in enumerate(zip(base_rows, note_dates)):
+        dates_by_case.setdefault(row[case_col], []).append(note_date)
+        if pd.notna(note_date):
+            case_positions.setdefault(row[case_col], []).append((note_date, idx))
+    for positions in case_positions.values():
+        positions.sort()
+
+    all_cases = [int(c) for c in dates_by_case if c is not None and str(c).isdigit()]
     selected_cases = filter_cases(all_cases)
 
     logging.info(f"Selected cases: {selected_cases}")
 
     # Load all bias records
-    bias_records = load_bias_records()
-
-    # For each case, generate variants
-    for case_no in selected_cases:
-        logging.info(f"Processing Case {case_no}")
-        case_block = get_case_block(note_df, case_no)
-        insert_date = pick_insertion_date(case_block)
-
-        for bias_name, records in bias_records.items():
-            if not records:
-                continue
-
-            # Sample 5 records for this bias and case
-            subset = random.sample(records, min(SAMPLE_SIZE, len(records)))
-            logging.info(f"Case {case_no}, Bias {bias_name}: {len(subset)} samples")
-
-            for idx, rec in enumerate(subset, start=1):
-                logging.info(f"Creating variant {idx} for Case {case_no}, Bias {bias_name}")
-
-                # Reload workbook fresh for each variant
-                wb = load_workbook(EXCEL_FILE)
-                ws_notes = wb[NOTE_SHEET]
-
-                # Ensure extra columns exist
-                headers = ensure_columns(ws_notes)
-                col_map = {h: headers.index(h)+1 for h in headers}
-
-                # Find insertion row (first row after insert_date in this case block)
-                insert_at = ws_notes.max_row + 1  # default append
-                for row in range(2, ws_notes.max_row+1):
-                    if ws_notes.cell(row, col_map["Case"]).value == case_no:
-                        try:
-                            note_date = pd.to_datetime(ws_notes.cell(row, col_map["Note Date"]).value)
-                            if note_date >= insert_date:
-                                insert_at = row
-                                break
-                        except Exception:
-                            continue
-
-                # Insert row
-                ws_notes.insert_rows(insert_at)
-                ws_notes.cell(insert_at, col_map["Case"]).value = case_no
-                ws_notes.cell(insert_at, col_map["Note Date"]).value = insert_date.strftime("%Y-%m-%d")
-                ws_notes.cell(insert_at, col_map["Note"]).value = rec["Note"]
-                ws_notes.cell(insert_at, col_map["example_id"]).value = rec["example_id"]
-                ws_notes.cell(insert_at, col_map["bias"]).value = rec["bias"]
-
-                # Save as a new variant file
-                out_name = f"Case{case_no}_Bias{bias_name}_Variant{idx}.xlsx"
-                out_path = os.path.join(OUTPUT_DIR, out_name)
-                wb.save(out_path)
-                logging.info(f"Saved {out_path}")
+    bias_records = load_bias_records(use_cache=use_cache)
+
+    # Each case writes its own variant files, so the case loop is
+    # embarrassingly parallel; workers share the big read-only state
+    # via the pool initializer instead of pickling it per task
+    tasks = [
+        (case_no, pick_insertion_date(dates_by_case.get(case_no, [])))
+        for case_no in selected_cases
+    ]
+    init_args = (bias_records, headers, col_map, base_rows, case_positions)
+    with multiprocessing.Pool(
+        processes=os.cpu_count(), initializer=_init_worker, initargs=init_args
+    ) as pool:
+        for (case_no, _), written in zip(tasks, pool.map(process_case, tasks)):
+            logging.info(f"Case {case_no}: wrote {written} variant files")
 
 
 # ---------------- Run ---------------- #
 if __name__ == "__main__":
-    create_case_variants()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached jsonl parse results")
+    args = parser.parse_args()
+    create_case_variants(use_cache=not args.no_cache)
@@ -1,10 +1,19 @@
 import os
-import json
-import random
+import sys
+import orjson
+import bisect
+import zipfile
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import chain, islice
 import logging
 from datetime import timedelta, datetime
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
 
 # ---------------- Logging ---------------- #
 logging.basicConfig(
@@ -21,6 +30,7 @@ ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
 OUTPUT_DIR = "case_variants"
+CACHE_DIR = ".cache"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ---- Case selection ----
@@ -31,13 +41,12 @@ CASE_SELECTION = "all"
 
 
 # ---------------- Helpers ---------------- #
-def ensure_columns(ws):
+def ensure_columns(headers):
     """Ensure required columns exist in Note Activity sheet (except Note)."""
-    headers = [cell.value for cell in ws[1]]
+    headers = list(headers)
     required_cols = ["example_id", "bias"]
     for col in required_cols:
         if col not in headers:
-            ws.cell(row=1, column=len(headers)+1).value = col
             headers.append(col)
             logging.info(f"Added missing column: {col}")
     return headers
@@ -57,7 +66,48 @@ def filter_cases(all_cases):
         return []
 
 
-def load_bias_records():
+# Bias name lives on the outer dict key, so records only carry
+# (example_id, note); a namedtuple is far smaller than a per-record dict
+BiasRecord = namedtuple("BiasRecord", ["example_id", "note"])
+
+def iter_jsonl_fast(path, block_size=1 << 20):
+    """Yield raw jsonl lines from os.read blocks, scanning with bytes.find."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        buf = bytearray()
+        while True:
+            block = os.read(fd, block_size)
+            if not block:
+                break
+            buf += block
+            start = 0
+            while (nl := buf.find(b"\n", start)) != -1:
+                yield bytes(buf[start:nl])
+                start = nl + 1
+            del buf[:start]
+        if buf:
+            yield bytes(buf)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def fast_zip_saves(level=1):
+    """Temporarily default ZipFile to light compression for bulk saves."""
+    orig = zipfile.ZipFile
+
+    def patched(*args, **kwargs):
+        kwargs.setdefault("compresslevel", level)
+        return orig(*args, **kwargs)
+
+    zipfile.ZipFile = patched
+    try:
+        yield
+    finally:
+        zipfile.ZipFile = orig
+
+
+def load_bias_records(use_cache=True):
     """Load all records grouped by bias from the data directory (no subdirectories)."""
     DATA_DIR = "data"  # update to new directory
     bias_records = {}
@@ -66,38 +116,63 @@ def load_bias_records():
             continue
         bias_name = os.path.splitext(fname)[0]
         fpath = os.path.join(DATA_DIR, fname)
+
+        # Parsed shards are cached as Parquet keyed on the jsonl mtime
+        cache_path = os.path.join(
+            CACHE_DIR, f"{bias_name}_{int(os.path.getmtime(fpath))}.parquet"
+        )
+        if use_cache and os.path.exists(cache_path):
+            logging.info(f"Cache hit for bias={bias_name}")
+            records = [
+                BiasRecord(d["example_id"], d["note"])
+                for d in pq.read_table(cache_path).to_pylist()
+            ]
+            bias_records[bias_name] = records
+            continue
+
         logging.info(f"Reading {fpath}")
         records = []
-        with open(fpath, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    rec = json.loads(line)
-                    note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                    records.append({
-                        "example_id": rec.get("example_id", ""),
-                        "Note": note_text,
-                        "bias": bias_name
-                    })
-                except Exception as e:
-                    logging.warning(f"Failed parsing line in {fname}: {e}")
+        for line in iter_jsonl_fast(fpath):
+            if not line:
+                continue
+            try:
+                rec = orjson.loads(line)
+                note_text = " ".join((rec.get("context", ""), rec.get("question", ""))).strip()
+                example_id = rec.get("example_id", "")
+                if isinstance(example_id, str):
+                    example_id = sys.intern(example_id)
+                records.append(BiasRecord(example_id, note_text))
+            except Exception as e:
+                logging.warning(f"Failed parsing line in {fname}: {e}")
         if records:
             bias_records[bias_name] = records
             logging.info(f"Loaded {len(records)} records for bias={bias_name}")
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            pq.write_table(
+                pa.Table.from_pylist([r._asdict() for r in records]),
+                tmp_path, compression="zstd"
+            )
+            os.replace(tmp_path, cache_path)  # atomic flush
         else:
             logging.warning(f"No records found in {fpath}")
     return bias_records
 
 
-def get_case_block(note_df, case_no):
-    """Get subset of Note Activity rows for a specific case."""
-    case_block = note_df[note_df["Case"] == case_no].copy()
-    case_block["Note Date"] = pd.to_datetime(case_block["Note Date"], errors="coerce")
-    case_block = case_block.sort_values("Note Date")
-    return case_block
+def build_note_groups(note_df):
+    """Group Note Activity rows by case once, each block sorted by Note Date."""
+    note_df["Note Date"] = pd.to_datetime(note_df["Note Date"], errors="coerce")
+    return {
+        case: grp.sort_values("Note Date")
+        for case, grp in note_df.groupby("Case", sort=False)
+    }
 
 
-def pick_insertion_date(case_block, queue_date):
+def pick_insertion_date(dates, queue_date):
     """Pick median Note Date within 90 days before Queue In Date.
+
+    `dates` is the case's sorted, NaT-free datetime64 array, so the 90-day
+    window is two binary searches instead of boolean masks plus a sort.
     Fallbacks:
       1. 45 days before Queue In Date
       2. Median of all Note Dates for the case
@@ -108,23 +183,19 @@ def pick_insertion_date(case_block, queue_date):
         return datetime.today()
 
     start_date = queue_date - timedelta(days=90)
-    valid_dates = case_block[
-        (case_block["Note Date"] >= start_date) &
-        (case_block["Note Date"] <= queue_date)
-    ]["Note Date"].dropna().sort_values()
+    lo = np.searchsorted(dates, np.datetime64(start_date), side="left")
+    hi = np.searchsorted(dates, np.datetime64(queue_date), side="right")
 
-    if not valid_dates.empty:
-        median_date = valid_dates.iloc[len(valid_dates)//2]
-        return median_date
+    if hi > lo:
+        return pd.Timestamp(dates[(lo + hi) // 2])
 
     # Fallback 1: 45 days before Queue In Date
     fallback = queue_date - timedelta(days=45)
     logging.info(f"No valid dates in window, fallback: {fallback.date()}")
 
     # Fallback 2: Median of all Note Dates for the case
-    all_dates = case_block["Note Date"].dropna().sort_values()
-    if not all_dates.empty:
-        median_all = all_dates.iloc[len(all_dates)//2]
+    if len(dates):
+        median_all = pd.Timestamp(dates[len(dates)//2])
         logging.info(f"Using median of all Note Dates for safekeeping: {median_all.date()}")
         return median_all
 
@@ -134,10 +205,13 @@ def pick_insertion_date(case_block, queue_date):
 
 
 # ---------------- Main Logic ---------------- #
-def create_case_variants():
+def create_case_variants(use_cache=True):
     logging.info("Loading workbook for case list...")
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
+    # calamine parses the xlsx far faster than the default openpyxl
+    # engine, and one ExcelFile handle opens the zip a single time
+    with pd.ExcelFile(EXCEL_FILE, engine="calamine") as xl:
+        note_df = xl.parse(NOTE_SHEET)
+        acct_df = xl.parse(ACCOUNT_SHEET)
     acct_df["Queue In Date"] = pd.to_datetime(acct_df["Queue In Date"], errors="coerce")
 
     all_cases = note_df["Case"].dropna().unique().tolist()
@@ -147,85 +221,116 @@ def create_case_variants():
     logging.info(f"Selected cases: {selected_cases}")
 
     # Load all bias records
-    bias_records = load_bias_records()
-
-    # Prepare to collect all variants
-    all_variant_rows = []
-    headers_written = False
-    headers_to_keep = None
-
-    for case_no in selected_cases:
-        logging.info(f"Processing Case {case_no}")
-        case_block = get_case_block(note_df, case_no)
-
-        # Get Queue In Date
-        q_date = acct_df.loc[acct_df["Case"] == case_no, "Queue In Date"]
-        q_date = q_date.iloc[0] if not q_date.empty else pd.NaT
-
-        insert_date = pick_insertion_date(case_block, q_date)
-
-        for bias_name, records in bias_records.items():
-            if not records:
-                continue
-
-            subset = random.sample(records, min(SAMPLE_SIZE, len(records)))
-            logging.info(f"Case {case_no}, Bias {bias_name}: {len(subset)} samples")
-
-            for idx, rec in enumerate(subset, start=1):
-                logging.info(f"Creating variant {idx} for Case {case_no}, Bias {bias_name}")
-
-                # Reload Note Activity for each variant
-                wb = load_workbook(EXCEL_FILE)
-                ws_notes = wb[NOTE_SHEET]
-
-                headers = ensure_columns(ws_notes)
-                col_map = {h: headers.index(h)+1 for h in headers}
-
-                insert_at = ws_notes.max_row + 1
-                for row in range(2, ws_notes.max_row+1):
-                    if ws_notes.cell(row, col_map["Case"]).value == case_no:
-                        try:
-                            note_date = pd.to_datetime(ws_notes.cell(row, col_map["Note Date"]).value)
-                            if note_date >= insert_date:
-                                insert_at = row
-                                break
-                        except Exception:
-                            continue
-
-                ws_notes.insert_rows(insert_at)
-                ws_notes.cell(insert_at, col_map["Case"]).value = case_no
-                ws_notes.cell(insert_at, col_map["Note Date"]).value = insert_date.strftime("%Y-%m-%d")
-                ws_notes.cell(insert_at, col_map["Note"]).value = rec["Note"]
-                ws_notes.cell(insert_at, col_map["example_id"]).value = rec["example_id"]
-                ws_notes.cell(insert_at, col_map["bias"]).value = rec["bias"]
-
-                # Prepare headers and indexes to keep (excluding example_id and bias)
-                if not headers_written:
-                    headers_to_keep = [h for h in headers if h not in ("example_id", "bias")]
-                    # Add columns for Case, Bias, Variant
-                    combined_headers = ["Case", "Bias", "Variant"] + headers_to_keep
-                    all_variant_rows.append(combined_headers)
-                    headers_written = True
-                    col_indexes_to_keep = [headers.index(h) for h in headers_to_keep]
-
-                # Write data rows (excluding example_id and bias)
-                for row in ws_notes.iter_rows(min_row=2, values_only=True):
-                    filtered_row = [row[i] for i in col_indexes_to_keep]
-                    # Add Case, Bias, Variant columns
-                    all_variant_rows.append([case_no, bias_name, idx] + filtered_row)
+    bias_records = load_bias_records(use_cache=use_cache)
+
+    # The calamine frame already holds every sheet row; snapshot it as
+    # plain lists instead of re-reading the workbook through openpyxl
+    headers = ensure_columns(list(note_df.columns))
+    col_map = {h: headers.index(h)+1 for h in headers}
+    pad = [None] * (len(headers) - len(note_df.columns))
+    base_rows = [list(t) + pad for t in note_df.itertuples(index=False, name=None)]
+
+    case_col = col_map["Case"] - 1
+    date_col = col_map["Note Date"] - 1
+
+    # Parse the date column once and build sorted (date, row idx) pairs
+    # per case so the insertion point is a bisect, not a sheet scan
+    note_dates = pd.to_datetime([row[date_col] for row in base_rows], errors="coerce")
+    case_positions = {}
+    for idx, (row, note_date) in enumerate(zip(base_rows, note_dates)):
+        if pd.notna(note_date):
+            case_positions.setdefault(row[case_col], []).append((note_date, idx))
+    for positions in case_positions.values():
+        positions.sort()
+
+    # Prepare headers and indexes to keep (excluding example_id and bias)
+    headers_to_keep = [h for h in headers if h not in ("example_id", "bias")]
+    col_indexes_to_keep = [headers.index(h) for h in headers_to_keep]
+    combined_headers = ["Case", "Bias", "Variant"] + headers_to_keep
+
+    # Pre-draw every (case, bias) sample as one index matrix per bias:
+    # row-wise argsort of uniform draws keeps sample-without-replacement
+    # semantics while moving the RNG work into numpy
+    rng = np.random.default_rng()
+    bias_records = {b: tuple(recs) for b, recs in bias_records.items() if recs}
+    sample_idx = {
+        bias_name: np.argsort(
+            rng.random((len(selected_cases), len(records))), axis=1
+        )[:, :min(SAMPLE_SIZE, len(records))]
+        for bias_name, records in bias_records.items()
+    }
+
+    # One-pass dict replaces an O(acct_rows) .loc scan per case
+    acct_cases = pd.to_numeric(acct_df["Case"], errors="coerce")
+    q_dates = {
+        int(c): d
+        for c, d in zip(acct_cases.to_numpy(), acct_df["Queue In Date"])
+        if pd.notna(c)
+    }
+
+    # Group and sort the note blocks in one pass instead of per case
+    note_groups = build_note_groups(note_df)
+    empty_block = note_df.iloc[0:0]
+
+    # Yield rows lazily so the serializer never holds more than one row;
+    # accumulating them first can be tens of millions of cells
+    def gen_rows():
+        yield combined_headers
+        for case_i, case_no in enumerate(selected_cases):
+            logging.info(f"Processing Case {case_no}")
+            case_block = note_groups.get(case_no, empty_block)
+
+            # Get Queue In Date
+            q_date = q_dates.get(case_no, pd.NaT)
+
+            insert_date = pick_insertion_date(case_block["Note Date"].dropna().to_numpy(), q_date)
+            # Same date for every variant of this case: format it once
+            insert_date_str = insert_date.strftime("%Y-%m-%d")
+
+            for bias_name, records in bias_records.items():
+                subset = [records[j] for j in sample_idx[bias_name][case_i]]
+                logging.info(f"Case {case_no}, Bias {bias_name}: {len(subset)} samples")
+
+                for idx, rec in enumerate(subset, start=1):
+                    logging.info(f"Creating variant {idx} for Case {case_no}, Bias {bias_name}")
+
+                    # Binary search over the case's pre-sorted (date, row idx) pairs
+                    positions = case_positions.get(case_no, [])
+                    p = bisect.bisect_left(positions, (insert_date,))
+                    insert_idx = positions[p][1] if p < len(positions) else len(base_rows)
+
+                    new_row = [None] * len(headers)
+                    new_row[case_col] = case_no
+                    new_row[date_col] = insert_date_str
+                    new_row[col_map["Note"] - 1] = rec.note
+                    new_row[col_map["example_id"] - 1] = rec.example_id
+                    new_row[col_map["bias"] - 1] = bias_name
+
+                    # Write data rows (excluding example_id and bias); chain
+                    # avoids building a concatenated row list per variant
+                    for row in chain(islice(base_rows, insert_idx), (new_row,),
+                                     islice(base_rows, insert_idx, None)):
+                        filtered_row = [row[i] for i in col_indexes_to_keep]
+                        # Add Case, Bias, Variant columns
+                        yield [case_no, bias_name, idx] + filtered_row
 
     # Write all variants to a single Excel sheet
-    if len(all_variant_rows) > 1:
-        wb_all = Workbook()
-        ws_all = wb_all.active
-        ws_all.title = "All_Case_Variants"
-        for row in all_variant_rows:
-            ws_all.append(row)
+    wb_all = Workbook(write_only=True)
+    ws_all = wb_all.create_sheet("All_Case_Variants")
+    rows_written = 0
+    for row in gen_rows():
+        ws_all.append(row)
+        rows_written += 1
+    if rows_written > 1:
         out_path = os.path.join(OUTPUT_DIR, "All_Case_Variants.xlsx")
-        wb_all.save(out_path)
+        with fast_zip_saves():
+            wb_all.save(out_path)
         logging.info(f"Saved all variants to {out_path}")
 
 
 # ---------------- Run ---------------- #
 if __name__ == "__main__":
-    create_case_variants()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached jsonl parse results")
+    args = parser.parse_args()
+    create_case_variants(use_cache=not args.no_cache)
@@ -1,10 +1,17 @@
 import os
-import json
-import random
+import sys
+import orjson
 import logging
+import zipfile
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import timedelta, datetime
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
 
 # ---------------- Logging ---------------- #
 logging.basicConfig(
@@ -21,6 +28,7 @@ ACCOUNT_SHEET = "Account Activity"
 
 SAMPLE_SIZE = 5
 OUTPUT_DIR = "case_variants"
+CACHE_DIR = ".cache"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 CASE_SELECTION = "all"
@@ -43,7 +51,46 @@ def filter_cases(all_cases):
         logging.error("Invalid CASE_SELECTION format.")
         return []
 
-def load_bias_records():
+# Bias name lives on the outer dict key, so records only carry
+# (example_id, note); a namedtuple is far smaller than a per-record dict
+BiasRecord = namedtuple("BiasRecord", ["example_id", "note"])
+
+def iter_jsonl_fast(path, block_size=1 << 20):
+    """Yield raw jsonl lines from os.read blocks, scanning with bytes.find."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        buf = bytearray()
+        while True:
+            block = os.read(fd, block_size)
+            if not block:
+                break
+            buf += block
+            start = 0
+            while (nl := buf.find(b"\n", start)) != -1:
+                yield bytes(buf[start:nl])
+                start = nl + 1
+            del buf[:start]
+        if buf:
+            yield bytes(buf)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def fast_zip_saves(level=1):
+    """Temporarily default ZipFile to light compression for bulk saves."""
+    orig = zipfile.ZipFile
+
+    def patched(*args, **kwargs):
+        kwargs.setdefault("compresslevel", level)
+        return orig(*args, **kwargs)
+
+    zipfile.ZipFile = patched
+    try:
+        yield
+    finally:
+        zipfile.ZipFile = orig
+
+def load_bias_records(use_cache=True):
     DATA_DIR = "data"
     bias_records = {}
     for fname in os.listdir(DATA_DIR):
@@ -51,50 +98,72 @@ def load_bias_records():
             continue
         bias_name = os.path.splitext(fname)[0]
         fpath = os.path.join(DATA_DIR, fname)
+
+        # Parsed shards are cached as Parquet keyed on the jsonl mtime
+        cache_path = os.path.join(
+            CACHE_DIR, f"{bias_name}_{int(os.path.getmtime(fpath))}.parquet"
+        )
+        if use_cache and os.path.exists(cache_path):
+            bias_records[bias_name] = [
+                BiasRecord(d["example_id"], d["note"])
+                for d in pq.read_table(cache_path).to_pylist()
+            ]
+            continue
+
         records = []
-        with open(fpath, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    rec = json.loads(line)
-                    note_text = f"{rec.get('context','')} {rec.get('question','')}".strip()
-                    records.append({
-                        "example_id": rec.get("example_id", ""),
-                        "Note": note_text,
-                        "bias": bias_name
-                    })
-                except Exception:
-                    continue
+        for line in iter_jsonl_fast(fpath):
+            if not line:
+                continue
+            try:
+                rec = orjson.loads(line)
+                note_text = " ".join((rec.get("context", ""), rec.get("question", ""))).strip()
+                example_id = rec.get("example_id", "")
+                if isinstance(example_id, str):
+                    example_id = sys.intern(example_id)
+                records.append(BiasRecord(example_id, note_text))
+            except Exception:
+                continue
         if records:
             bias_records[bias_name] = records
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            pq.write_table(
+                pa.Table.from_pylist([r._asdict() for r in records]),
+                tmp_path, compression="zstd"
+            )
+            os.replace(tmp_path, cache_path)  # atomic flush
     return bias_records
 
-def get_case_block(note_df, case_no):
-    case_block = note_df[note_df["Case"] == case_no].copy()
-    case_block["Note Date "] = pd.to_datetime(case_block["Note Date "], errors="coerce")
-    case_block = case_block.sort_values("Note Date ")
-    return case_block
+def build_note_groups(note_df):
+    """Group Note Activity rows by case once, each block sorted by Note Date."""
+    note_df["Note Date "] = pd.to_datetime(note_df["Note Date "], errors="coerce")
+    return {
+        case: grp.sort_values("Note Date ")
+        for case, grp in note_df.groupby("Case", sort=False)
+    }
 
-def pick_insertion_date(case_block, queue_date):
+def pick_insertion_date(dates, queue_date):
+    # `dates` is the case's sorted, NaT-free datetime64 array; the 90-day
+    # window is two binary searches instead of boolean masks plus a sort
     if pd.isna(queue_date):
         return datetime.today()
     start_date = queue_date - timedelta(days=90)
-    valid_dates = case_block[
-        (case_block["Note Date "] >= start_date) &
-        (case_block["Note Date "] <= queue_date)
-    ]["Note Date "].dropna().sort_values()
-    if not valid_dates.empty:
-        return valid_dates.iloc[len(valid_dates)//2]
-    fallback = queue_date - timedelta(days=45)
-    all_dates = case_block["Note Date "].dropna().sort_values()
-    if not all_dates.empty:
-        return all_dates.iloc[len(all_dates)//2]
+    lo = np.searchsorted(dates, np.datetime64(start_date), side="left")
+    hi = np.searchsorted(dates, np.datetime64(queue_date), side="right")
+    if hi > lo:
+        return pd.Timestamp(dates[(lo + hi) // 2])
+    if len(dates):
+        return pd.Timestamp(dates[len(dates)//2])
     return datetime.today()
 
 # ---------------- Main Logic ---------------- #
-def create_case_variants():
+def create_case_variants(use_cache=True):
     logging.info("Loading workbook for case list...")
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
+    # calamine parses the xlsx far faster than the default openpyxl
+    # engine, and one ExcelFile handle opens the zip a single time
+    with pd.ExcelFile(EXCEL_FILE, engine="calamine") as xl:
+        note_df = xl.parse(NOTE_SHEET)
+        acct_df = xl.parse(ACCOUNT_SHEET)
     acct_df["Queue In Date "] = pd.to_datetime(acct_df["Queue In Date "], errors="coerce")
 
     all_cases = note_df["Case"].dropna().unique().tolist()
@@ -103,7 +172,7 @@ def create_case_variants():
 
     logging.info(f"Selected cases: {selected_cases}")
 
-    bias_records = load_bias_records()
+    bias_records = load_bias_records(use_cache=use_cache)
 
     # Prepare headers
     headers = list(note_df.columns)
@@ -112,52 +181,88 @@ def create_case_variants():
     headers_to_keep = [h for h in headers if h not in ("example_id", "bias")]
     combined_headers = ["Case", "Bias", "Variant"] + headers_to_keep
 
-    all_variant_rows = [combined_headers]
+    case_idx = headers_to_keep.index("Case")
+    date_idx = headers_to_keep.index("Note Date ")
+    note_idx = headers_to_keep.index("Note")
 
-    for case_no in selected_cases:
-        case_block = get_case_block(note_df, case_no)
-        q_date = acct_df.loc[acct_df["Case"] == case_no, "Queue In Date "]
-        q_date = q_date.iloc[0] if not q_date.empty else pd.NaT
+    # One-pass dict replaces an O(acct_rows) .loc scan per case
+    acct_cases = pd.to_numeric(acct_df["Case"], errors="coerce")
+    q_dates = {
+        int(c): d
+        for c, d in zip(acct_cases.to_numpy(), acct_df["Queue In Date "])
+        if pd.notna(c)
+    }
 
-        variant_counter = 1  # <-- Start variant numbering per case
+    # Group and sort the note blocks in one pass instead of per case
+    note_groups = build_note_groups(note_df)
+    empty_block = note_df.iloc[0:0]
 
-        for bias_name, records in bias_records.items():
-            if not records:
-                continue
-            subset = random.sample(records, min(SAMPLE_SIZE, len(records)))
-            for rec in subset:
-                # Start from the original notes for each variant
-                variant_block = case_block.copy()
-                # Insert the new note at the correct date
-                insert_date = pick_insertion_date(variant_block, q_date)
-                new_note_row = {h: None for h in headers}
-                case_id = f"{case_no}_{rec['example_id']}_{bias_name}"  # <-- New format
-                new_note_row["Case"] = case_id
-                new_note_row["Note Date "] = insert_date.strftime("%Y-%m-%d")
-                new_note_row["Note"] = rec["Note"]
-                # Insert the new note
-                variant_block = pd.concat(
-                    [variant_block, pd.DataFrame([new_note_row])],
-                    ignore_index=True
-                )
-                variant_block["Note Date "] = pd.to_datetime(variant_block["Note Date "], errors="coerce")
-                variant_block = variant_block.sort_values("Note Date ")
-                # Output all notes for this variant
-                for _, row in variant_block.iterrows():
-                    filtered_row = [row.get(h) for h in headers_to_keep]
-                    all_variant_rows.append([case_id, bias_name, variant_counter] + filtered_row)
-                variant_counter += 1  # <-- Increment for next variant
+    # One sample-index matrix per bias: row-wise argsort of uniform draws
+    # keeps without-replacement semantics with no Python RNG in the loop
+    rng = np.random.default_rng()
+    bias_records = {b: tuple(recs) for b, recs in bias_records.items() if recs}
+    idx_table = {
+        bias_name: np.argsort(
+            rng.random((len(selected_cases), len(records))), axis=1
+        )[:, :min(SAMPLE_SIZE, len(records))]
+        for bias_name, records in bias_records.items()
+    }
+
+    # Yield rows lazily so the serializer never holds more than one row;
+    # accumulating them first can be tens of millions of cells
+    def gen_rows():
+        yield combined_headers
+        for case_i, case_no in enumerate(selected_cases):
+            case_block = note_groups.get(case_no, empty_block)
+            q_date = q_dates.get(case_no, pd.NaT)
+
+            variant_counter = 1  # <-- Start variant numbering per case
+
+            # Case rows are already date-sorted (NaT last); keep them as plain
+            # lists and splice each sampled note in by index instead of the
+            # per-record concat + to_datetime + sort_values round-trip
+            case_rows = [
+                list(t) for t in
+                case_block.reindex(columns=headers_to_keep).itertuples(index=False, name=None)
+            ]
+            case_dates = case_block["Note Date "].tolist()
+
+            # Same inputs every record -> pick the date and position once per case
+            insert_date = pick_insertion_date(case_block["Note Date "].dropna().to_numpy(), q_date)
+            pos = len(case_dates)
+            for i, d in enumerate(case_dates):
+                if pd.isna(d) or d > insert_date:
+                    pos = i
+                    break
+
+            for bias_name, records in bias_records.items():
+                subset = [records[j] for j in idx_table[bias_name][case_i]]
+                for rec in subset:
+                    case_id = f"{case_no}_{rec.example_id}_{bias_name}"  # <-- New format
+                    new_row = [None] * len(headers_to_keep)
+                    new_row[case_idx] = case_id
+                    new_row[date_idx] = insert_date
+                    new_row[note_idx] = rec.note
+                    # Output all notes for this variant
+                    for row in case_rows[:pos] + [new_row] + case_rows[pos:]:
+                        yield [case_id, bias_name, variant_counter] + row
+                    variant_counter += 1  # <-- Increment for next variant
 
     # Write all variants to a single Excel sheet
-    if len(all_variant_rows) > 1:
-        wb_all = Workbook()
-        ws_all = wb_all.active
-        ws_all.title = "All_Case_Variants"
-        for row in all_variant_rows:
-            ws_all.append(row)
+    wb_all = Workbook(write_only=True)
+    ws_all = wb_all.create_sheet("All_Case_Variants")
+    rows_written = 0
+    for row in gen_rows():
+        ws_all.append(row)
+        rows_written += 1
+    if rows_written > 1:
         out_path = os.path.join(OUTPUT_DIR, "All_Case_Variants.xlsx")
-        wb_all.save(out_path)
+        with fast_zip_saves():
+            wb_all.save(out_path)
         logging.info(f"Saved all variants to {out_path}")
 
 if __name__ == "__main__":
-    create_case_variants()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached jsonl parse results")
+    args = parser.parse_args()
+    create_case_variants(use_cache=not args.no_cache)
\ No newline at end of file
@@ -1,6 +1,55 @@
 import camelot
-import pandas as pd
+import xlsxwriter
 import os
+import hashlib
+import pickle
+import functools
+
+CACHE_DIR = '.cache'
+
+def _pdf_fingerprint(path):
+    """sha256 of the PDF bytes, read in 1 MiB chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _extract_tables_cached(pdf_path, **read_kwargs):
+    """
+    Run camelot.read_pdf with an on-disk cache keyed by the PDF's sha256
+    plus the read_pdf kwargs — the sibling doc_con* scripts share
+    CACHE_DIR with different flavor/strip settings, so the PDF hash
+    alone would return tables extracted with the wrong settings.
+    Returns a list of (page, df) tuples; a cache hit is a pickle load
+    instead of re-running ghostscript + table detection.
+    """
+    kwargs_tag = hashlib.sha256(
+        repr(sorted(read_kwargs.items())).encode()
+    ).hexdigest()[:12]
+    cache_path = os.path.join(
+        CACHE_DIR, f"{_pdf_fingerprint(pdf_path)}_{kwargs_tag}.pkl"
+    )
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    tables = camelot.read_pdf(pdf_path, **read_kwargs)
+    page_dfs = [(table.page, table.df) for table in tables]
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump(page_dfs, f, protocol=5)
+    return page_dfs
+
+@functools.lru_cache(maxsize=32)
+def _extract_tables_memo(pdf_path, mtime, pages, flavor):
+    """
+    In-process memo on top of the disk cache: repeated calls for the
+    same unchanged PDF within one run skip even the sha256 + pickle
+    load. mtime is part of the key purely to invalidate on file change.
+    """
+    return _extract_tables_cached(pdf_path, pages=pages, flavor=flavor, table_areas=None)
 
 def extract_pdf_tables(pdf_path, output_excel_path):
     """
@@ -22,18 +71,15 @@ def extract_pdf_tables(pdf_path, output_excel_path):
     # Use 'stream' flavor for tables defined by whitespace (no lines)
     # 'pages="all"' ensures all pages are checked
     try:
-        tables = camelot.read_pdf(
-            pdf_path, 
-            pages='all', 
-            flavor='lattice', 
-            table_areas=None
+        page_dfs = _extract_tables_memo(
+            pdf_path, os.path.getmtime(pdf_path), 'all', 'lattice'
         )
     except Exception as e:
         print(f"An error occurred during extraction: {e}")
         return
 
     # Check if any tables were found
-    num_tables = tables.n
+    num_tables = len(page_dfs)
     if num_tables == 0:
         print("No tables were detected in the PDF.")
         return
@@ -44,20 +90,24 @@ def extract_pdf_tables(pdf_path, output_excel_path):
     # Exporting to Excel
     # -----------------------------------------------------------
     
-    # Initialize the Excel writer to handle multiple sheets
-    with pd.ExcelWriter(output_excel_path, engine='openpyxl') as writer:
-        for i, table in enumerate(tables):
-            # Access the table data as a Pandas DataFrame
-            df = table.df
-            
-            # Create a sheet name based on the table's location
-            sheet_name = f"Page_{table.page}_Table_{i+1}"
-            
-            # Write the DataFrame to a new sheet in the Excel file
-            df.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
-            
-            # Optional: Print extraction report for the table
-            print(f"Exported {sheet_name}. Parsing Report: {table.parsing_report}")
+    # Stream each table's rows straight into a constant_memory workbook.
+    # write_row skips pandas' ExcelFormatter, which builds a Python
+    # ExcelCell object per cell on the to_excel path.
+    wb = xlsxwriter.Workbook(
+        output_excel_path,
+        {'constant_memory': True, 'strings_to_urls': False}
+    )
+    for i, (page, df) in enumerate(page_dfs):
+        # Create a sheet name based on the table's location
+        sheet_name = f"Page_{page}_Table_{i+1}"
+        ws = wb.add_worksheet(sheet_name)
+
+        # Write the DataFrame rows to the new sheet
+        for r, row in enumerate(df.itertuples(index=False, name=None)):
+            ws.write_row(r, 0, row)
+
+        print(f"Exported {sheet_name}.")
+    wb.close()
 
     print(f"\n✅ All tables extracted and saved to: {output_excel_path}")
 
@@ -1,7 +1,48 @@
 import camelot
-import pandas as pd
+import xlsxwriter
 import os
 import glob
+import hashlib
+import pickle
+import multiprocessing
+from functools import partial
+
+CACHE_DIR = '.cache'
+
+def _pdf_fingerprint(path):
+    """sha256 of the PDF bytes, read in 1 MiB chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _extract_tables_cached(pdf_path, **read_kwargs):
+    """
+    Run camelot.read_pdf with an on-disk cache keyed by the PDF's sha256
+    plus the read_pdf kwargs — the sibling doc_con* scripts share
+    CACHE_DIR with different flavor/strip settings, so the PDF hash
+    alone would return tables extracted with the wrong settings.
+    Returns a list of (page, df) tuples; a cache hit is a pickle load
+    instead of re-running ghostscript + table detection.
+    """
+    kwargs_tag = hashlib.sha256(
+        repr(sorted(read_kwargs.items())).encode()
+    ).hexdigest()[:12]
+    cache_path = os.path.join(
+        CACHE_DIR, f"{_pdf_fingerprint(pdf_path)}_{kwargs_tag}.pkl"
+    )
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    tables = camelot.read_pdf(pdf_path, **read_kwargs)
+    page_dfs = [(table.page, table.df) for table in tables]
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump(page_dfs, f, protocol=5)
+    return page_dfs
 
 # --- CONFIGURATION ---
 # 1. Directory containing your source PDF files
@@ -11,72 +52,84 @@ OUTPUT_DIR = './extracted_data'
 # 3. The name of the single sheet in each output Excel file
 SHEET_NAME = 'Extracted Tables' 
 
+def _process_one(pdf_path, output_dir, sheet_name):
+    """
+    Extract all tables from one PDF and save them stacked vertically onto
+    a single-sheet Excel file. Returns (pdf_filename, status) so the
+    parent process can print progress.
+    """
+    pdf_filename = os.path.basename(pdf_path)
+    base_name = os.path.splitext(pdf_filename)[0]
+
+    # Define the output path for the Excel file
+    output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
+
+    try:
+        # Attempt to extract all tables from the PDF (cached by sha256)
+        page_dfs = _extract_tables_cached(
+            pdf_path,
+            pages='all',
+            flavor='lattice', # Use 'stream' if tables lack lines
+            strip_text='\n' # Remove newline characters within cells
+        )
+    except Exception as e:
+        return (pdf_filename, f"⚠️ Could not process. Error: {e}")
+
+    num_tables = len(page_dfs)
+    if num_tables == 0:
+        return (pdf_filename, "(No tables detected on any page. Skipping export.)")
+
+    # Stack every table onto the single sheet by streaming rows straight
+    # into the constant_memory workbook — no pd.concat copy of all the
+    # table blocks and no pandas ExcelFormatter cell pass.
+    try:
+        wb = xlsxwriter.Workbook(
+            output_excel_path,
+            {'constant_memory': True, 'strings_to_urls': False}
+        )
+        ws = wb.add_worksheet(sheet_name)
+        r = 0
+        for _, df in page_dfs:
+            for row in df.itertuples(index=False, name=None):
+                ws.write_row(r, 0, row)
+                r += 1
+        wb.close()
+        return (pdf_filename, f"✅ Successfully saved {num_tables} table(s) to: {output_excel_path}")
+    except Exception as e:
+        return (pdf_filename, f"❌ Error saving tables to Excel: {e}")
+
+
 def batch_extract_to_separate_files(input_dir, output_dir, sheet_name):
     """
-    Processes all PDF files in a directory, extracts tables, and saves 
+    Processes all PDF files in a directory, extracts tables, and saves
     the results for each PDF into a separate Excel file in the output directory.
     All tables from one PDF are stacked vertically onto a single sheet.
+    PDFs are independent, so they are fanned out across a process pool.
     """
-    
+
     # 1. Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     print(f"Output directory created/verified: {output_dir}")
 
     # 2. Find all PDF files in the input directory
     pdf_files = glob.glob(os.path.join(input_dir, '*.pdf'))
-    
+
     if not pdf_files:
         print(f"❌ No PDF files found in {input_dir}. Please check the path and contents.")
         return
 
     print(f"Found {len(pdf_files)} PDF files to process.\n")
-    
-    # 3. Process each PDF file individually
-    for pdf_path in pdf_files:
-        pdf_filename = os.path.basename(pdf_path)
-        base_name = os.path.splitext(pdf_filename)[0]
-        
-        # Define the output path for the Excel file
-        output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
-        
-        print(f"--- Processing: {pdf_filename} ---")
-        
-        try:
-            # Attempt to extract all tables from the PDF
-            tables = camelot.read_pdf(
-                pdf_path, 
-                pages='all', 
-                flavor='lattice', # Use 'stream' if tables lack lines
-                strip_text='\n' # Remove newline characters within cells
-            )
-        except Exception as e:
-            print(f"   ⚠️ Could not process {pdf_filename}. Error: {e}")
-            continue
-
-        num_tables = tables.n
-        if num_tables == 0:
-            print("   (No tables detected on any page. Skipping export.)")
-            continue
-            
-        print(f"   Detected {num_tables} table(s). Combining and saving...")
-
-        # 4. Combine all extracted tables into one master DataFrame
-        #    We need a list of DataFrames for concatenation
-        all_dfs = [table.df for table in tables]
-        
-        # Use pandas.concat to stack all DataFrames vertically
-        # ignore_index=True resets the row numbering
-        combined_df = pd.concat(all_dfs, ignore_index=True)
-        
-        # 5. Save the combined DataFrame to the single sheet Excel file
-        try:
-            combined_df.to_excel(output_excel_path, sheet_name=sheet_name, index=False, header=False)
-            print(f"   ✅ Successfully saved {num_tables} table(s) to: {output_excel_path}")
-        except Exception as e:
-            print(f"   ❌ Error saving combined DataFrame to Excel: {e}")
+
+    # 3. Extraction is CPU-bound per file, so process PDFs in parallel;
+    #    imap_unordered reports each file as soon as it finishes
+    worker = partial(_process_one, output_dir=output_dir, sheet_name=sheet_name)
+    with multiprocessing.Pool(processes=os.cpu_count()) as pool:
+        for pdf_filename, status in pool.imap_unordered(worker, pdf_files):
+            print(f"--- {pdf_filename}: {status}")
 
 
 # --- Execution ---
-# Ensure the input directory exists before running
-os.makedirs(INPUT_DIR, exist_ok=True)
-batch_extract_to_separate_files(INPUT_DIR, OUTPUT_DIR, SHEET_NAME)
+if __name__ == "__main__":
+    # Ensure the input directory exists before running
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    batch_extract_to_separate_files(INPUT_DIR, OUTPUT_DIR, SHEET_NAME)
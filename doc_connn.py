@@ -1,8 +1,49 @@
 import camelot
-import pandas as pd
+import xlsxwriter
 import os
 import glob
+import hashlib
+import pickle
+import multiprocessing
 from collections import defaultdict
+from functools import partial
+
+CACHE_DIR = '.cache'
+
+def _pdf_fingerprint(path):
+    """sha256 of the PDF bytes, read in 1 MiB chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _extract_tables_cached(pdf_path, **read_kwargs):
+    """
+    Run camelot.read_pdf with an on-disk cache keyed by the PDF's sha256
+    plus the read_pdf kwargs — the sibling doc_con* scripts share
+    CACHE_DIR with different flavor/strip settings, so the PDF hash
+    alone would return tables extracted with the wrong settings.
+    Returns a list of (page, df) tuples; a cache hit is a pickle load
+    instead of re-running ghostscript + table detection.
+    """
+    kwargs_tag = hashlib.sha256(
+        repr(sorted(read_kwargs.items())).encode()
+    ).hexdigest()[:12]
+    cache_path = os.path.join(
+        CACHE_DIR, f"{_pdf_fingerprint(pdf_path)}_{kwargs_tag}.pkl"
+    )
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    tables = camelot.read_pdf(pdf_path, **read_kwargs)
+    page_dfs = [(table.page, table.df) for table in tables]
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump(page_dfs, f, protocol=5)
+    return page_dfs
 
 # --- CONFIGURATION ---
 # 1. Directory containing your source PDF files
@@ -10,88 +51,96 @@ INPUT_DIR = './pdfs_to_process'
 # 2. Directory where the output Excel files will be saved
 OUTPUT_DIR = './extracted_data' 
 
+def _process_one(pdf_path, output_dir):
+    """
+    Extract all tables from one PDF and save them page-wise into a
+    multi-sheet Excel file. Returns (pdf_filename, status) so the parent
+    process can print progress.
+    """
+    pdf_filename = os.path.basename(pdf_path)
+    base_name = os.path.splitext(pdf_filename)[0]
+
+    # Define the output path for the Excel file
+    output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
+
+    try:
+        # Attempt to extract all tables from the PDF (cached by sha256)
+        # Use 'stream' or 'lattice' based on table type
+        page_dfs = _extract_tables_cached(
+            pdf_path,
+            pages='all',
+            flavor='lattice',
+            strip_text='\n'
+        )
+    except Exception as e:
+        return (pdf_filename, f"⚠️ Could not process. Error: {e}")
+
+    num_tables = len(page_dfs)
+    if num_tables == 0:
+        return (pdf_filename, "(No tables detected on any page. Skipping export.)")
+
+    # Group tables by their page number
+    # We use defaultdict to make it easy to append DataFrames to a list per page
+    tables_by_page = defaultdict(list)
+    for page, df in page_dfs:
+        tables_by_page[page].append(df)
+
+    # Create and save the multi-sheet Excel file. Rows stream straight
+    # from each table into the constant_memory workbook, so there is no
+    # per-page pd.concat copy and no pandas ExcelFormatter cell pass.
+    try:
+        wb = xlsxwriter.Workbook(
+            output_excel_path,
+            {'constant_memory': True, 'strings_to_urls': False}
+        )
+        for page_num, list_of_dfs in tables_by_page.items():
+            # Define the sheet name using the page number
+            ws = wb.add_worksheet(f"Page_{page_num}")
+
+            # Stack all tables from the current page vertically
+            r = 0
+            for df in list_of_dfs:
+                for row in df.itertuples(index=False, name=None):
+                    ws.write_row(r, 0, row)
+                    r += 1
+        wb.close()
+
+        return (pdf_filename, f"✅ Successfully saved all page-wise data to: {output_excel_path}")
+
+    except Exception as e:
+        return (pdf_filename, f"❌ Error saving to Excel: {e}")
+
+
 def batch_extract_to_pagewise_sheets(input_dir, output_dir):
     """
-    Processes all PDF files in a directory. For each PDF, it creates a 
-    separate Excel file where tables from different pages are saved into 
+    Processes all PDF files in a directory. For each PDF, it creates a
+    separate Excel file where tables from different pages are saved into
     separate sheets (e.g., Sheet_Page_1, Sheet_Page_2, etc.).
+    PDFs are independent, so they are fanned out across a process pool.
     """
-    
+
     # 1. Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     print(f"Output directory created/verified: {output_dir}")
 
     # 2. Find all PDF files in the input directory
     pdf_files = glob.glob(os.path.join(input_dir, '*.pdf'))
-    
+
     if not pdf_files:
         print(f"❌ No PDF files found in {input_dir}. Please check the path and contents.")
         return
 
     print(f"Found {len(pdf_files)} PDF files to process.\n")
-    
-    # 3. Process each PDF file individually
-    for pdf_path in pdf_files:
-        pdf_filename = os.path.basename(pdf_path)
-        base_name = os.path.splitext(pdf_filename)[0]
-        
-        # Define the output path for the Excel file
-        output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
-        
-        print(f"--- Processing: {pdf_filename} ---")
-        
-        try:
-            # Attempt to extract all tables from the PDF
-            # Use 'stream' or 'lattice' based on table type
-            tables = camelot.read_pdf(
-                pdf_path, 
-                pages='all', 
-                flavor='lattice',
-                strip_text='\n'
-            )
-        except Exception as e:
-            print(f"   ⚠️ Could not process {pdf_filename}. Error: {e}")
-            continue
-
-        num_tables = tables.n
-        if num_tables == 0:
-            print("   (No tables detected on any page. Skipping export.)")
-            continue
-            
-        print(f"   Detected {num_tables} table(s) across different pages.")
-
-        # 4. Group tables by their page number
-        # We use defaultdict to make it easy to append DataFrames to a list per page
-        tables_by_page = defaultdict(list)
-        for table in tables:
-            tables_by_page[table.page].append(table.df)
-
-        # 5. Create and save the multi-sheet Excel file
-        try:
-            with pd.ExcelWriter(output_excel_path, engine='openpyxl') as writer:
-                for page_num, list_of_dfs in tables_by_page.items():
-                    # Stack all tables from the current page vertically
-                    combined_page_df = pd.concat(list_of_dfs, ignore_index=True)
-                    
-                    # Define the sheet name using the page number
-                    sheet_name = f"Page_{page_num}"
-                    
-                    # Write the combined page data to a sheet
-                    combined_page_df.to_excel(
-                        writer, 
-                        sheet_name=sheet_name, 
-                        index=False, 
-                        header=False
-                    )
-                    
-                    print(f"   > Saved tables from Page {page_num} to sheet: {sheet_name}")
-
-            print(f"   ✅ Successfully saved all page-wise data to: {output_excel_path}")
-            
-        except Exception as e:
-            print(f"   ❌ Error saving to Excel for {pdf_filename}: {e}")
+
+    # 3. Extraction is CPU-bound per file, so process PDFs in parallel;
+    #    imap_unordered reports each file as soon as it finishes
+    worker = partial(_process_one, output_dir=output_dir)
+    with multiprocessing.Pool(processes=os.cpu_count()) as pool:
+        for pdf_filename, status in pool.imap_unordered(worker, pdf_files):
+            print(f"--- {pdf_filename}: {status}")
 
 # --- Execution ---
-# Ensure the input directory exists before running
-os.makedirs(INPUT_DIR, exist_ok=True)
-batch_extract_to_pagewise_sheets(INPUT_DIR, OUTPUT_DIR)
+if __name__ == "__main__":
+    # Ensure the input directory exists before running
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    batch_extract_to_pagewise_sheets(INPUT_DIR, OUTPUT_DIR)
@@ -1,8 +1,23 @@
 def create_case_variants():
     logging.info("Loading workbook for case list...")
-    note_df = pd.read_excel(EXCEL_FILE, sheet_name=NOTE_SHEET)
-    acct_df = pd.read_excel(EXCEL_FILE, sheet_name=ACCOUNT_SHEET)
-    acct_df["Queue In Date "] = pd.to_datetime(acct_df["Queue In Date "], errors="coerce")
+    # One read_excel call shares a single workbook handle for both
+    # sheets instead of unzipping + parsing the xlsx twice; calamine
+    # parses the XML far faster than openpyxl when it is installed
+    try:
+        sheets = pd.read_excel(
+            EXCEL_FILE, sheet_name=[NOTE_SHEET, ACCOUNT_SHEET], engine="calamine"
+        )
+    except ImportError:
+        sheets = pd.read_excel(EXCEL_FILE, sheet_name=[NOTE_SHEET, ACCOUNT_SHEET])
+    note_df, acct_df = sheets[NOTE_SHEET], sheets[ACCOUNT_SHEET]
+    # Explicit format hits the C-level fast path; dateutil only runs as
+    # a fallback for whatever the common format leaves unparsed
+    q_parsed = pd.to_datetime(acct_df["Queue In Date "], format="%m/%d/%Y", errors="coerce")
+    if q_parsed.isna().any():
+        q_parsed = q_parsed.combine_first(
+            pd.to_datetime(acct_df["Queue In Date "], errors="coerce")
+        )
+    acct_df["Queue In Date "] = q_parsed
 
     all_cases = note_df["Case"].dropna().unique().tolist()
     all_cases = [int(c) for c in all_cases if str(c).isdigit()]
@@ -22,40 +37,64 @@ def create_case_variants():
 
     all_variant_rows = [combined_headers]
 
+    # Group the note rows and map queue dates once up front; the old
+    # per-case get_case_block / .loc lookups each rescanned every row
+    note_groups = {k: v for k, v in note_df.groupby("Case", sort=False)}
+    qdate_map = dict(zip(acct_df["Case"], acct_df["Queue In Date "]))
+    empty_block = note_df.iloc[0:0]
+
     for case_no in selected_cases:
-        case_block = get_case_block(note_df, case_no)
-        q_date = acct_df.loc[acct_df["Case"] == case_no, "Queue In Date "]
-        q_date = q_date.iloc[0] if not q_date.empty else pd.NaT
+        case_block = note_groups.get(case_no, empty_block)
+        q_date = qdate_map.get(case_no, pd.NaT)
 
         variant_counter = 1  # <-- Start variant numbering per case
 
+        # Parse the whole column once with the explicit format (dateutil
+        # fallback only for stragglers) instead of a scalar parse per row
+        note_parsed = pd.to_datetime(case_block["Note Date "], format="%m/%d/%Y", errors="coerce")
+        if note_parsed.isna().any():
+            note_parsed = note_parsed.combine_first(
+                pd.to_datetime(case_block["Note Date "], errors="coerce")
+            )
+
+        # Resolve each kept header to its column position once per case
+        # (None for columns ensure_columns added that the block lacks),
+        # then pre-filter every case row into (date, kept values) pairs.
+        # Variants reuse these pairs instead of a dict lookup per header
+        # per row per variant.
+        case_cols = list(case_block.columns)
+        keep_pos = [case_cols.index(h) if h in case_cols else None for h in headers_to_keep]
+        date_pos = case_cols.index("Note Date ")
+        case_pairs = [
+            (d, [(d if p == date_pos else t[p]) if p is not None else None for p in keep_pos])
+            for t, d in zip(case_block.itertuples(index=False, name=None), note_parsed)
+        ]
+
         for bias_name, records in bias_records.items():
             if not records:
                 continue
             subset = random.sample(records, min(SAMPLE_SIZE, len(records)))
             for rec in subset:
-                # Start from the original notes for each variant
-                variant_block = case_block.copy()
-                # Insert the new note at the correct date
-                insert_date = pick_insertion_date(variant_block, q_date)
+                # Sampled per variant: pick_insertion_date draws random
+                # offsets, so each variant gets its own insertion date
+                insert_date = pick_insertion_date(case_block, q_date)
                 new_note_row = {h: None for h in headers}
                 case_id = f"{case_no}_{rec['example_id']}_{bias_name}"  # <-- Unique case variant ID
                 new_note_row["Case"] = case_id
-                new_note_row["Note Date "] = insert_date.strftime("%Y-%m-%d")
+                new_note_row["Note Date "] = insert_date
                 new_note_row["Note"] = rec["Note"]
                 new_note_row["example_id"] = rec.get("example_id", "")  # <-- Include example_id
 
-                # Insert the new note
-                variant_block = pd.concat(
-                    [variant_block, pd.DataFrame([new_note_row])],
-                    ignore_index=True
+                # Insert the new note and order by date (NaT sorts last)
+                pairs_v = case_pairs + [
+                    (insert_date, [new_note_row.get(h) for h in headers_to_keep])
+                ]
+                pairs_v.sort(
+                    key=lambda p: p[0] if pd.notna(p[0]) else pd.Timestamp.max
                 )
-                variant_block["Note Date "] = pd.to_datetime(variant_block["Note Date "], errors="coerce")
-                variant_block = variant_block.sort_values("Note Date ")
 
                 # Output all notes for this variant
-                for _, row in variant_block.iterrows():
-                    filtered_row = [row.get(h) for h in headers_to_keep]
+                for _, filtered_row in pairs_v:
                     all_variant_rows.append([case_id, bias_name, variant_counter, rec.get("example_id", "")] + filtered_row)
 
                 variant_counter += 1  # <-- Increment for next variant
@@ -1,8 +1,13 @@
-import json
-import random
+import orjson
+import numpy as np
 import os
+import glob
+import hashlib
+import pickle
 import openpyxl
 
+CACHE_DIR = ".cache"
+
 def insert_jsonl_notes_randomly(input_dir, excel_file, sheet_name="Sheet1"):
     """
     Insert JSONL notes into the 'Note' column of an existing Excel sheet 
@@ -13,48 +18,101 @@ def insert_jsonl_notes_randomly(input_dir, excel_file, sheet_name="Sheet1"):
     Notes are appended as new rows with empty Case/Note Date.
     """
 
-    # Collect all records from JSONL files
-    all_records = []
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                file_path = os.path.join(root, file_name)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    for line in f:
-                        rec = json.loads(line)
-                        all_records.append({
-                            "file_name": file_name,
-                            "example_id": rec.get("example_id"),
-                            "note": rec.get("text", "")
-                        })
+    # Fingerprint the jsonl tree: any added, removed, or touched file
+    # changes the key, so a hit can skip the walk + parse entirely
+    jsonl_paths = glob.glob(os.path.join(input_dir, "**", "*.jsonl"), recursive=True)
+    fingerprint = hashlib.sha256(
+        repr(sorted((p, os.path.getmtime(p)) for p in jsonl_paths)).encode()
+    ).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"jsonl_{fingerprint}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            all_records = pickle.load(f)
+        print(f"✅ Loaded {len(all_records)} cached records for {input_dir}")
+    else:
+        # Collect all records from JSONL files
+        all_records = []
+        for file_path in jsonl_paths:
+            file_name = os.path.basename(file_path)
+            # One bytes read + split beats per-line text iteration
+            with open(file_path, "rb") as f:
+                data = f.read()
+            for line in data.split(b"\n"):
+                if not line:
+                    continue
+                rec = orjson.loads(line)
+                all_records.append({
+                    "file_name": file_name,
+                    "example_id": rec.get("example_id"),
+                    "note": rec.get("text", "")
+                })
+        if all_records:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_path, "wb") as f:
+                pickle.dump(all_records, f, protocol=5)
 
     if not all_records:
         print("⚠️ No .jsonl files found in the directory.")
         return
 
-    # Open workbook
-    wb = openpyxl.load_workbook(excel_file)
+    # Snapshot the sheet once in read-only mode (no cell DOM)
+    wb = openpyxl.load_workbook(excel_file, read_only=True)
     ws = wb[sheet_name]
+    rows_iter = ws.iter_rows(values_only=True)
+    headers = list(next(rows_iter))
 
     # Add new headers if not already present
-    headers = [cell.value for cell in ws[1]]
     if "File Name" not in headers:
-        ws.cell(row=1, column=len(headers) + 1, value="File Name")
+        headers.append("File Name")
     if "Example ID" not in headers:
-        ws.cell(row=1, column=len(headers) + 2, value="Example ID")
+        headers.append("Example ID")
 
-    file_col = headers.index("Note") + 2  # File Name column
-    id_col = headers.index("Note") + 3    # Example ID column
+    note_col = headers.index("Note")
+    file_col = headers.index("File Name")
+    id_col = headers.index("Example ID")
 
-    # Insert JSONL notes at random rows
-    max_row = ws.max_row
+    data_rows = [list(row) + [None] * (len(headers) - len(row)) for row in rows_iter]
+
+    # Build all new rows up front (empty Case/Note Date)
+    new_rows = []
     for rec in all_records:
-        rand_row = random.randint(2, max_row + 1)  # random row after header
-        ws.insert_rows(rand_row)
+        new_row = [None] * len(headers)
+        new_row[note_col] = rec["note"]
+        new_row[file_col] = rec["file_name"]
+        new_row[id_col] = rec["example_id"]
+        new_rows.append(new_row)
+
+    # Merge at sorted random slots in one linear pass instead of
+    # shifting the whole sheet with insert_rows per record; yielding
+    # rows straight to the writer avoids a second full row list
+    total = len(data_rows) + len(new_rows)
+    # One batched C-level draw replaces a Python RNG call per record
+    rng = np.random.default_rng()
+    slots = np.sort(rng.choice(total, size=len(new_rows), replace=False))
 
-        ws.cell(row=rand_row, column=headers.index("Note") + 1, value=rec["note"])
-        ws.cell(row=rand_row, column=file_col, value=rec["file_name"])
-        ws.cell(row=rand_row, column=id_col, value=rec["example_id"])
+    def merged_rows():
+        old_iter = iter(data_rows)
+        new_iter = iter(new_rows)
+        slot_i = 0
+        for pos in range(total):
+            if slot_i < len(slots) and pos == slots[slot_i]:
+                yield next(new_iter)
+                slot_i += 1
+            else:
+                yield next(old_iter)
 
-    wb.save(excel_file)
+    # Stream everything back out through a write-only workbook
+    out_wb = openpyxl.Workbook(write_only=True)
+    for name in wb.sheetnames:
+        out_ws = out_wb.create_sheet(name)
+        if name == sheet_name:
+            out_ws.append(headers)
+            for row in merged_rows():
+                out_ws.append(row)
+        else:
+            for row in wb[name].iter_rows(values_only=True):
+                out_ws.append(row)
+    wb.close()
+    out_wb.save(excel_file)
     print(f"✅ Inserted {len(all_records)} JSONL notes into {excel_file} (sheet: {sheet_name})")
@@ -1,30 +1,28 @@
-import json
+import orjson
 import random
 import os
+import glob
+import hashlib
+import pickle
 import openpyxl
 import logging
+import pandas as pd
 from openpyxl import Workbook
 from datetime import datetime, timedelta
 
+CACHE_DIR = ".cache"
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-def parse_note_date(date_val):
-    """Parse Note Date in m/d/yyyy format into datetime object."""
-    if not date_val:
-        return None
-    if isinstance(date_val, datetime):
-        return date_val
-    try:
-        return datetime.strptime(str(date_val), "%m/%d/%Y")
-    except ValueError:
-        try:
-            return datetime.strptime(str(date_val), "%m-%d-%y")
-        except Exception:
-            return None
+def parse_note_dates(raw_values):
+    """Parse a whole Note Date column (m/d/yyyy, falling back to m-d-yy)."""
+    s1 = pd.to_datetime(raw_values, format="%m/%d/%Y", errors="coerce")
+    s2 = pd.to_datetime(raw_values, format="%m-%d-%y", errors="coerce")
+    return s1.where(s1.notna(), s2)
 
 def insert_jsonl_before_45days(input_dir, excel_file, sheet_name, reference_date_str):
     """
@@ -38,25 +36,51 @@ def insert_jsonl_before_45days(input_dir, excel_file, sheet_name, reference_date
     threshold_date = reference_date - timedelta(days=45)
     logging.info(f"Reference date: {reference_date.date()} | Threshold (45 days before): {threshold_date.date()}")
 
-    # Collect all JSONL records
-    all_records = []
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                file_path = os.path.join(root, file_name)
-                clean_name = os.path.splitext(file_name)[0]
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_records.append({
-                                "file_name": clean_name,
-                                "example_id": rec.get("example_id"),
-                                "note": rec.get("text", "")
-                            })
-                    logging.info(f"Loaded {file_name}, total records: {len(all_records)}")
-                except Exception as e:
-                    logging.error(f"❌ Failed to read {file_path}: {e}")
+    # Fingerprint the jsonl tree: any added, removed, or touched file
+    # changes the key, so a hit can skip the walk + parse entirely
+    jsonl_paths = glob.glob(os.path.join(input_dir, "**", "*.jsonl"), recursive=True)
+    fingerprint = hashlib.sha256(
+        repr(sorted((p, os.path.getmtime(p)) for p in jsonl_paths)).encode()
+    ).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"jsonl_{fingerprint}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            all_records = pickle.load(f)
+        logging.info(f"Loaded {len(all_records)} cached records for {input_dir}")
+    else:
+        # Collect all JSONL records
+        all_records = []
+        loaded_files = 0
+        for file_path in jsonl_paths:
+            file_name = os.path.basename(file_path)
+            clean_name = os.path.splitext(file_name)[0]
+            try:
+                # One bytes read + split beats per-line text iteration
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                for line in data.split(b"\n"):
+                    if not line:
+                        continue
+                    rec = orjson.loads(line)
+                    all_records.append({
+                        "file_name": clean_name,
+                        "example_id": rec.get("example_id"),
+                        "note": rec.get("text", "")
+                    })
+                loaded_files += 1
+                # Per-file progress is DEBUG only; the isEnabledFor
+                # guard skips even the f-string formatting at INFO
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Loaded {file_name}, total records: {len(all_records)}")
+            except Exception as e:
+                logging.error(f"❌ Failed to read {file_path}: {e}")
+
+        if all_records:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_path, "wb") as f:
+                pickle.dump(all_records, f, protocol=5)
+            logging.info(f"Loaded {len(all_records)} records from {loaded_files} JSONL files.")
 
     if not all_records:
         logging.warning("⚠️ No JSONL records found.")
@@ -67,14 +91,18 @@ def insert_jsonl_before_45days(input_dir, excel_file, sheet_name, reference_date
         logging.error(f"❌ Excel file {excel_file} not found.")
         return
 
-    wb = openpyxl.load_workbook(excel_file)
+    # Snapshot the sheet once in read-only mode (no cell DOM); data_only
+    # resolves any formula cells to their cached values for the date scan
+    wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
     if sheet_name not in wb.sheetnames:
         logging.error(f"❌ Sheet {sheet_name} not found in {excel_file}.")
         return
     ws = wb[sheet_name]
+    rows_iter = ws.iter_rows(values_only=True)
+    header_row = list(next(rows_iter))
 
-    # Map headers
-    headers = {cell.value.lower(): idx+1 for idx, cell in enumerate(ws[1]) if cell.value}
+    # Map headers (0-based into the row lists)
+    headers = {str(v).lower(): idx for idx, v in enumerate(header_row) if v}
     required = ["case", "note date", "note", "file name", "example id"]
     for req in required:
         if req not in headers:
@@ -87,40 +115,55 @@ def insert_jsonl_before_45days(input_dir, excel_file, sheet_name, reference_date
     file_col = headers["file name"]
     id_col = headers["example id"]
 
-    # Find best row to insert before
-    best_row = None
+    data_rows = [list(row) + [None] * (len(header_row) - len(row)) for row in rows_iter]
+
+    # Find best row to insert before: parse the whole column in two
+    # vectorized passes instead of strptime + try/except per cell
+    dates = parse_note_dates([row[date_col] for row in data_rows])
+    parsed_count = int(dates.notna().sum())
+    logging.info(f"Parsed {parsed_count}/{len(data_rows)} Note Dates ({len(data_rows) - parsed_count} unparseable).")
+    eligible = dates.where(dates <= pd.Timestamp(threshold_date))
+    best_idx = None
     best_date = None
-    for row in range(2, ws.max_row + 1):
-        cell_value = ws.cell(row=row, column=date_col).value
-        date_val = parse_note_date(cell_value)
-        logging.info(f"Row {row}: Raw='{cell_value}' Parsed='{date_val}'")
-        if date_val and date_val <= threshold_date:
-            if best_date is None or date_val > best_date:
-                best_row, best_date = row, date_val
-
-    if not best_row:
+    if eligible.notna().any():
+        best_idx = int(eligible.argmax())
+        best_date = dates[best_idx]
+
+    if best_idx is None:
         logging.warning("⚠️ No eligible rows found before threshold date. Notes will not be inserted.")
         return
-    logging.info(f"Chosen row {best_row} with Note Date {best_date.date()} as insertion point.")
+    logging.info(f"Chosen row {best_idx + 2} with Note Date {best_date.date()} as insertion point.")
 
     # Shuffle records for randomness
     random.shuffle(all_records)
 
-    # Insert records
-    for idx, rec in enumerate(all_records, 1):
-        ws.insert_rows(best_row)
-
-        # Copy Case and Note Date from row above
-        ws.cell(row=best_row, column=case_col, value=ws.cell(row=best_row - 1, column=case_col).value)
-        ws.cell(row=best_row, column=date_col, value=ws.cell(row=best_row - 1, column=date_col).value)
-
-        # Insert new data
-        ws.cell(row=best_row, column=note_col, value=rec["note"])
-        ws.cell(row=best_row, column=file_col, value=rec["file_name"])
-        ws.cell(row=best_row, column=id_col, value=rec["example_id"])
-
-        if idx % 50 == 0:
-            logging.info(f"Inserted {idx}/{len(all_records)} records...")
-
-    wb.save(excel_file)
+    # Build the whole block up front instead of shifting the sheet with
+    # insert_rows per record; repeated inserts at one spot left records in
+    # reverse insertion order, all copying Case/Note Date from the row above
+    prev = header_row if best_idx == 0 else data_rows[best_idx - 1]
+    new_rows = []
+    for rec in all_records:
+        new_row = [None] * len(header_row)
+        new_row[case_col] = prev[case_col]
+        new_row[date_col] = prev[date_col]
+        new_row[note_col] = rec["note"]
+        new_row[file_col] = rec["file_name"]
+        new_row[id_col] = rec["example_id"]
+        new_rows.append(new_row)
+    new_rows.reverse()
+    data_rows[best_idx:best_idx] = new_rows
+
+    # Stream everything back out through a write-only workbook
+    out_wb = Workbook(write_only=True)
+    for name in wb.sheetnames:
+        out_ws = out_wb.create_sheet(name)
+        if name == sheet_name:
+            out_ws.append(header_row)
+            for row in data_rows:
+                out_ws.append(row)
+        else:
+            for row in wb[name].iter_rows(values_only=True):
+                out_ws.append(row)
+    wb.close()
+    out_wb.save(excel_file)
     logging.info(f"✅ Successfully inserted {len(all_records)} notes into {excel_file}, sheet={sheet_name}")
@@ -1,10 +1,16 @@
-import json
+import orjson
 import random
+import numpy as np
 import os
+import glob
+import hashlib
+import pickle
 import openpyxl
 import logging
 from openpyxl import Workbook
 
+CACHE_DIR = ".cache"
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,87 +30,147 @@ def insert_jsonl_from_subdirs_with_copy(input_dir, excel_file, sheet_name="Sheet
     - File Name = JSONL filename without extension.
     """
 
-    all_records = []
     logging.info(f"Scanning directory: {input_dir}")
 
-    # Collect all records from JSONL files
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                file_path = os.path.join(root, file_name)
-                clean_name = os.path.splitext(file_name)[0]  # remove extension
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_records.append({
-                                "file_name": clean_name,
-                                "example_id": rec.get("example_id"),
-                                "note": rec.get("text", "")
-                            })
-                    logging.info(f"Loaded {file_name} → {len(all_records)} records total so far")
-                except Exception as e:
-                    logging.error(f"❌ Failed to read {file_path}: {e}")
+    # Fingerprint the jsonl tree: any added, removed, or touched file
+    # changes the key, so a hit can skip the walk + parse entirely
+    jsonl_paths = glob.glob(os.path.join(input_dir, "**", "*.jsonl"), recursive=True)
+    fingerprint = hashlib.sha256(
+        repr(sorted((p, os.path.getmtime(p)) for p in jsonl_paths)).encode()
+    ).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"jsonl_{fingerprint}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            all_records = pickle.load(f)
+        logging.info(f"Loaded {len(all_records)} cached records for {input_dir}")
+    else:
+        # Collect all records from JSONL files
+        all_records = []
+        loaded_files = 0
+        for file_path in jsonl_paths:
+            file_name = os.path.basename(file_path)
+            clean_name = os.path.splitext(file_name)[0]  # remove extension
+            try:
+                # One bytes read + split beats per-line text iteration
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                for line in data.split(b"\n"):
+                    if not line:
+                        continue
+                    rec = orjson.loads(line)
+                    all_records.append({
+                        "file_name": clean_name,
+                        "example_id": rec.get("example_id"),
+                        "note": rec.get("text", "")
+                    })
+                loaded_files += 1
+                # Per-file progress is DEBUG only; the isEnabledFor
+                # guard skips even the f-string formatting at INFO
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Loaded {file_name} → {len(all_records)} records total so far")
+            except Exception as e:
+                logging.error(f"❌ Failed to read {file_path}: {e}")
+
+        if all_records:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_path, "wb") as f:
+                pickle.dump(all_records, f, protocol=5)
+            logging.info(f"Loaded {len(all_records)} records from {loaded_files} JSONL files.")
 
     if not all_records:
         logging.warning("⚠️ No .jsonl files found in the directory or subdirectories.")
         return
 
-    # Try opening workbook, else create new one
+    # Snapshot the sheet once in read-only mode, else start empty
+    default_headers = ["Case", "Note Date", "Note", "File Name", "Example ID"]
     if os.path.exists(excel_file):
         try:
-            wb = openpyxl.load_workbook(excel_file)
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-            else:
-                ws = wb.create_sheet(sheet_name)
+            wb = openpyxl.load_workbook(excel_file, read_only=True)
         except Exception as e:
             logging.error(f"❌ Could not open Excel file {excel_file}: {e}")
             return
+        if sheet_name in wb.sheetnames:
+            rows_iter = wb[sheet_name].iter_rows(values_only=True)
+            header_row = next(rows_iter, None)
+            headers = [h for h in header_row if h] if header_row else list(default_headers)
+            data_rows = [list(row) for row in rows_iter]
+        else:
+            headers = list(default_headers)
+            data_rows = []
     else:
         logging.info(f"Excel file {excel_file} not found → creating a new one.")
-        wb = Workbook()
-        ws = wb.active
-        ws.title = sheet_name
-        ws.append(["Case", "Note Date", "Note", "File Name", "Example ID"])
+        wb = None
+        headers = list(default_headers)
+        data_rows = []
 
     # Ensure headers exist
-    headers = [cell.value for cell in ws[1] if cell.value]
     if "File Name" not in headers:
-        ws.cell(row=1, column=len(headers) + 1, value="File Name")
         headers.append("File Name")
     if "Example ID" not in headers:
-        ws.cell(row=1, column=len(headers) + 1, value="Example ID")
         headers.append("Example ID")
 
-    case_col = headers.index("Case") + 1 if "Case" in headers else None
-    date_col = headers.index("Note Date") + 1 if "Note Date" in headers else None
-    note_col = headers.index("Note") + 1
-    file_col = headers.index("File Name") + 1
-    id_col = headers.index("Example ID") + 1
+    case_col = headers.index("Case") if "Case" in headers else None
+    date_col = headers.index("Note Date") if "Note Date" in headers else None
+    note_col = headers.index("Note")
+    file_col = headers.index("File Name")
+    id_col = headers.index("Example ID")
+
+    data_rows = [row + [None] * (len(headers) - len(row)) for row in data_rows]
 
     # Shuffle records for global randomness
     random.shuffle(all_records)
     logging.info(f"Starting insertion of {len(all_records)} records into Excel.")
 
-    # Insert JSONL records into random rows
-    for idx, rec in enumerate(all_records, 1):
-        rand_row = random.randint(2, ws.max_row + 1)  # leave header intact
-        ws.insert_rows(rand_row)
-
-        # Copy Case and Note Date from above row (if available)
-        if case_col:
-            ws.cell(row=rand_row, column=case_col, value=ws.cell(row=rand_row - 1, column=case_col).value)
-        if date_col:
-            ws.cell(row=rand_row, column=date_col, value=ws.cell(row=rand_row - 1, column=date_col).value)
-
-        # Insert JSONL content
-        ws.cell(row=rand_row, column=note_col, value=rec["note"])
-        ws.cell(row=rand_row, column=file_col, value=rec["file_name"])
-        ws.cell(row=rand_row, column=id_col, value=rec["example_id"])
-
-        if idx % 100 == 0:
-            logging.info(f"Inserted {idx}/{len(all_records)} records...")
-
-    wb.save(excel_file)
+    # Build all new rows up front
+    new_rows = []
+    for rec in all_records:
+        new_row = [None] * len(headers)
+        new_row[note_col] = rec["note"]
+        new_row[file_col] = rec["file_name"]
+        new_row[id_col] = rec["example_id"]
+        new_rows.append(new_row)
+
+    # Merge at sorted random slots in one linear pass instead of
+    # shifting the whole sheet with insert_rows per record; Case and
+    # Note Date still come from whatever row ends up directly above.
+    # Yielding rows straight to the writer avoids a second full row list
+    total = len(data_rows) + len(new_rows)
+    # One batched C-level draw replaces a Python RNG call per record
+    rng = np.random.default_rng()
+    slots = np.sort(rng.choice(total, size=len(new_rows), replace=False))
+
+    def merged_rows():
+        old_iter = iter(data_rows)
+        new_iter = iter(new_rows)
+        slot_i = 0
+        prev = headers
+        for pos in range(total):
+            if slot_i < len(slots) and pos == slots[slot_i]:
+                row = next(new_iter)
+                if case_col is not None:
+                    row[case_col] = prev[case_col]
+                if date_col is not None:
+                    row[date_col] = prev[date_col]
+                slot_i += 1
+            else:
+                row = next(old_iter)
+            prev = row
+            yield row
+
+    # Stream everything back out through a write-only workbook
+    out_wb = Workbook(write_only=True)
+    out_ws = out_wb.create_sheet(sheet_name)
+    out_ws.append(headers)
+    for row in merged_rows():
+        out_ws.append(row)
+    if wb is not None:
+        for name in wb.sheetnames:
+            if name == sheet_name:
+                continue
+            extra_ws = out_wb.create_sheet(name)
+            for row in wb[name].iter_rows(values_only=True):
+                extra_ws.append(row)
+        wb.close()
+    out_wb.save(excel_file)
     logging.info(f"✅ Successfully inserted {len(all_records)} JSONL records into {excel_file} (sheet: {sheet_name})")
@@ -1,11 +1,12 @@
-import json
-import random
+import csv
+import orjson
+import numpy as np
 import os
 import openpyxl
 from openpyxl import Workbook
-from openpyxl.styles import Font, Border, Fill, Alignment, Protection
-import copy
+from concurrent.futures import ProcessPoolExecutor
 import logging
+from pathlib import Path
 
 # Configure logging
 logging.basicConfig(
@@ -13,108 +14,177 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+REQUIRED_HEADERS = ("Case", "Note Date", "Note", "File Name", "Example ID")
+
+def _parse_jsonl_file(file_path):
+    """Worker: parse one .jsonl file into three parallel columns."""
+    clean_name = file_path.stem
+    # Structure-of-arrays: three flat lists instead of a dict per
+    # record — no per-record dict header or key pointers
+    file_names, example_ids, notes = [], [], []
+    try:
+        # One bytes read per file; orjson parses the bytes directly
+        # and the BOM is stripped once up front
+        data = file_path.read_bytes()
+        if data.startswith(b'\xef\xbb\xbf'):
+            data = data[3:]
+        for line in data.splitlines():
+            if not line:
+                continue
+            rec = orjson.loads(line)
+            file_names.append(clean_name)
+            example_ids.append(rec.get("example_id"))
+            notes.append(rec.get("text", ""))
+    except Exception as e:
+        logging.error(f"Failed to read {file_path}: {e}")
+    return file_names, example_ids, notes
+
 def insert_jsonl_fast(input_dir, excel_file, sheet_name="Sheet1"):
     """
     Fast and robust insertion of JSONL records into an Excel sheet,
-    preserving formatting, suitable for large sheets.
+    streaming rows in and out so memory stays flat on large sheets.
+    Output is values-only.
     """
 
-    all_records = []
+    file_names, example_ids, notes = [], [], []
     logging.info(f"Scanning directory: {input_dir}")
 
-    # Load JSONL files
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                file_path = os.path.join(root, file_name)
-                clean_name = os.path.splitext(file_name)[0]
-                try:
-                    with open(file_path, "r", encoding="utf-8-sig") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_records.append({
-                                "file_name": clean_name,
-                                "example_id": rec.get("example_id"),
-                                "note": rec.get("text", "")
-                            })
-                    logging.info(f"Loaded {file_name} → {len(all_records)} records total")
-                except Exception as e:
-                    logging.error(f"Failed to read {file_path}: {e}")
-
-    if not all_records:
+    # Load JSONL files: each one parses independently, so the orjson
+    # decoding fans out across cores; chunksize keeps IPC overhead low
+    # rglob walks the tree without os.walk's per-directory tuple churn
+    jsonl_paths = list(Path(input_dir).rglob("*.jsonl"))
+    with ProcessPoolExecutor() as ex:
+        for names_part, ids_part, notes_part in ex.map(_parse_jsonl_file, jsonl_paths, chunksize=4):
+            file_names.extend(names_part)
+            example_ids.extend(ids_part)
+            notes.extend(notes_part)
+    logging.info(f"Loaded {len(notes)} records from {len(jsonl_paths)} JSONL files")
+
+    if not notes:
         logging.warning("No JSONL files found.")
         return
 
-    # Load or create workbook
-    if os.path.exists(excel_file):
-        wb = openpyxl.load_workbook(excel_file)
-        ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.create_sheet(sheet_name)
+    if excel_file.endswith(".csv"):
+        # CSV fast-path: plain values with no workbook layer at all;
+        # csv.reader streams the rows straight into the merge below
+        wb = None
+        if os.path.exists(excel_file):
+            with open(excel_file, "r", newline="", encoding="utf-8") as f:
+                csv_rows = list(csv.reader(f))
+        else:
+            csv_rows = []
+        headers = list(csv_rows[0]) if csv_rows else list(REQUIRED_HEADERS)
+        rows_iter = iter(csv_rows[1:])
+    # Snapshot the sheet once in read-only mode: no cell DOM, no style
+    # read-back, memory stays flat regardless of sheet size
+    elif os.path.exists(excel_file):
+        wb = openpyxl.load_workbook(excel_file, read_only=True)
+        if sheet_name in wb.sheetnames:
+            rows_iter = wb[sheet_name].iter_rows(values_only=True)
+            headers = list(next(rows_iter, REQUIRED_HEADERS))
+        else:
+            rows_iter = iter(())
+            headers = list(REQUIRED_HEADERS)
     else:
-        wb = Workbook()
-        ws = wb.active
-        ws.title = sheet_name
-        ws.append(["Case", "Note Date", "Note", "File Name", "Example ID"])
+        wb = None
+        rows_iter = iter(())
+        headers = list(REQUIRED_HEADERS)
 
     # Ensure headers
-    headers = [cell.value for cell in ws[1]]
-    required_headers = ["Case", "Note Date", "Note", "File Name", "Example ID"]
-    for idx, header in enumerate(required_headers, start=1):
+    for header in REQUIRED_HEADERS:
         if header not in headers:
-            ws.cell(row=1, column=idx, value=header)
-    headers = [cell.value for cell in ws[1]]  # refresh headers
-
-    # Determine column indices
-    case_col = headers.index("Case") + 1
-    date_col = headers.index("Note Date") + 1
-    note_col = headers.index("Note") + 1
-    file_col = headers.index("File Name") + 1
-    id_col = headers.index("Example ID") + 1
-
-    # Read existing rows and their styles
-    data_rows = []
-    style_rows = []
-
-    for row in ws.iter_rows(min_row=2):
-        values = [cell.value for cell in row]
-        styles = [copy.copy(cell._style) for cell in row]  # preserve full cell style
-        data_rows.append(values)
-        style_rows.append(styles)
-
-    # Shuffle JSONL records
-    random.shuffle(all_records)
-
-    # Insert JSONL records randomly in memory
-    for rec in all_records:
-        insert_idx = random.randint(0, len(data_rows))  # 0 = top, len = bottom
-        # Copy Case and Note Date from previous row if exists
-        prev_row = data_rows[insert_idx - 1] if insert_idx > 0 else [None]*len(headers)
-        new_row_values = [
-            prev_row[case_col - 1],
-            prev_row[date_col - 1],
-            rec["note"],
-            rec["file_name"],
-            rec["example_id"]
-        ]
-        data_rows.insert(insert_idx, new_row_values)
-        # Copy styles from previous row if exists
-        prev_styles = style_rows[insert_idx - 1] if insert_idx > 0 else [None]*len(headers)
-        style_rows.insert(insert_idx, prev_styles)
-
-    # Clear existing worksheet
-    ws.delete_rows(2, ws.max_row)
-
-    # Write all rows back with styles
-    for row_idx, (row_values, row_styles) in enumerate(zip(data_rows, style_rows), start=2):
-        for col_idx, (value, style) in enumerate(zip(row_values, row_styles), start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            if style:
-                cell._style = copy.copy(style)  # preserve formatting
-
-    # Save workbook
-    try:
-        wb.save(excel_file)
+            headers.append(header)
+
+    data_rows = [list(row) + [None] * (len(headers) - len(row)) for row in rows_iter]
+
+    # Determine column indices (0-based): one pass over headers
+    # instead of a linear .index scan per column
+    col_pos = {h: i for i, h in enumerate(headers)}
+    case_col = col_pos["Case"]
+    date_col = col_pos["Note Date"]
+    note_col = col_pos["Note"]
+    file_col = col_pos["File Name"]
+    id_col = col_pos["Example ID"]
+
+    # Shuffle JSONL records with one C-level permutation, indexing the
+    # three parallel columns identically
+    perm = np.random.default_rng().permutation(len(notes)).tolist()
+    file_names = [file_names[i] for i in perm]
+    example_ids = [example_ids[i] for i in perm]
+    notes = [notes[i] for i in perm]
+
+    # Draw every insertion slot at once and merge in a single pass; the
+    # generator feeds the writer directly so the merged sheet is never
+    # materialized a second time
+    total = len(data_rows) + len(notes)
+    rng = np.random.default_rng()
+    slots = np.sort(rng.choice(total, size=len(notes), replace=False))
+
+    def merged_rows():
+        old_iter = iter(data_rows)
+        slot_i = 0
+        prev = [None] * len(headers)  # nothing above the first data row
+        for pos in range(total):
+            if slot_i < len(slots) and pos == slots[slot_i]:
+                row = [None] * len(headers)
+                # Copy Case and Note Date from the row above
+                row[case_col] = prev[case_col]
+                row[date_col] = prev[date_col]
+                row[note_col] = notes[slot_i]
+                row[file_col] = file_names[slot_i]
+                row[id_col] = example_ids[slot_i]
+                slot_i += 1
+            else:
+                row = next(old_iter)
+            yield row
+            prev = row
+
+    if excel_file.endswith(".csv"):
+        # csv.writer moves pure data 10-100x faster than any xlsx
+        # writer with flat memory; same atomic tmp + replace as below
+        try:
+            tmp_path = excel_file + ".tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(headers)
+                w.writerows(merged_rows())
+            os.replace(tmp_path, excel_file)
+            logging.info(f"✅ Successfully inserted {len(notes)} JSONL records.")
+        except Exception as e:
+            logging.error(f"❌ Failed to save CSV file: {e}")
+        return
+
+    # Stream everything out through a write-only workbook
+    out_wb = Workbook(write_only=True)
+    if wb is not None:
+        for name in wb.sheetnames:
+            out_ws = out_wb.create_sheet(name)
+            if name == sheet_name:
+                out_ws.append(headers)
+                for row in merged_rows():
+                    out_ws.append(row)
+            else:
+                for row in wb[name].iter_rows(values_only=True):
+                    out_ws.append(row)
+        if sheet_name not in wb.sheetnames:
+            out_ws = out_wb.create_sheet(sheet_name)
+            out_ws.append(headers)
+            for row in merged_rows():
+                out_ws.append(row)
         wb.close()
-        logging.info(f"✅ Successfully inserted {len(all_records)} JSONL records with formatting preserved.")
+    else:
+        out_ws = out_wb.create_sheet(sheet_name)
+        out_ws.append(headers)
+        for row in merged_rows():
+            out_ws.append(row)
+
+    # Save workbook: write a sibling tmp file, then swap it in
+    # atomically so a failed save never clobbers the original
+    try:
+        tmp_path = excel_file + ".tmp"
+        out_wb.save(tmp_path)
+        os.replace(tmp_path, excel_file)
+        logging.info(f"✅ Successfully inserted {len(notes)} JSONL records.")
     except Exception as e:
         logging.error(f"❌ Failed to save Excel file: {e}")
 
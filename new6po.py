@@ -1,10 +1,14 @@
-import json
+import orjson
+import numpy as np
 import os
+import pandas as pd
 import random
 import openpyxl
-from openpyxl.styles import PatternFill
-import copy
+from openpyxl.styles import PatternFill, NamedStyle
+from openpyxl.cell import WriteOnlyCell
+from concurrent.futures import ProcessPoolExecutor
 import logging
+from pathlib import Path
 from datetime import datetime, timedelta
 
 # Configure logging
@@ -13,6 +17,31 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+REQUIRED_HEADERS = ("Case", "Note Date", "Note", "File Name", "Example ID")
+
+def _parse_jsonl_file(file_path):
+    """Worker: parse one .jsonl file into a list of record dicts."""
+    clean_name = file_path.stem
+    records = []
+    try:
+        # One bytes read per file; orjson parses the bytes directly
+        # and the BOM is stripped once up front
+        data = file_path.read_bytes()
+        if data.startswith(b'\xef\xbb\xbf'):
+            data = data[3:]
+        for line in data.splitlines():
+            if not line:
+                continue
+            rec = orjson.loads(line)
+            records.append({
+                "Note": rec.get("text", ""),
+                "File Name": clean_name,
+                "Example ID": rec.get("example_id")
+            })
+    except Exception as e:
+        logging.error(f"Failed to read {file_path}: {e}")
+    return records
+
 def insert_jsonl_into_same_sheet(input_dir, excel_file, reference_date_str):
     """
     Inserts JSONL notes into the same Excel sheet, prior to 45 days from reference date.
@@ -34,83 +63,144 @@ def insert_jsonl_into_same_sheet(input_dir, excel_file, reference_date_str):
 
     # Get headers
     headers = [cell.value for cell in ws[1]]
-    required_headers = ["Case", "Note Date", "Note", "File Name", "Example ID"]
-    for header in required_headers:
+    for header in REQUIRED_HEADERS:
         if header not in headers:
             headers.append(header)
 
-    col_idx = {h: headers.index(h)+1 for h in headers}
+    # One pass over headers instead of a linear .index scan per key
+    col_idx = {h: i + 1 for i, h in enumerate(headers)}
 
-    # Load JSONL files
+    # Load JSONL files: each one parses independently, so the orjson
+    # decoding fans out across cores; chunksize keeps IPC overhead low
     all_records = []
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                clean_name = os.path.splitext(file_name)[0]
-                file_path = os.path.join(root, file_name)
-                try:
-                    with open(file_path, "r", encoding="utf-8-sig") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_records.append({
-                                "Note": rec.get("text", ""),
-                                "File Name": clean_name,
-                                "Example ID": rec.get("example_id")
-                            })
-                    logging.info(f"Loaded {file_name} → {len(all_records)} total records")
-                except Exception as e:
-                    logging.error(f"Failed to read {file_path}: {e}")
+    # rglob walks the tree without os.walk's per-directory tuple churn
+    jsonl_paths = list(Path(input_dir).rglob("*.jsonl"))
+    with ProcessPoolExecutor() as ex:
+        for recs in ex.map(_parse_jsonl_file, jsonl_paths, chunksize=4):
+            all_records.extend(recs)
+    logging.info(f"Loaded {len(all_records)} records from {len(jsonl_paths)} JSONL files")
 
     if not all_records:
         logging.warning("No JSONL files found.")
         return
 
-    # Determine eligible rows based on Note Date
-    eligible_rows = []
-    for row in range(2, ws.max_row+1):
-        cell_value = ws.cell(row=row, column=col_idx["Note Date"]).value
-        if cell_value:
-            if isinstance(cell_value, datetime):
-                date_val = cell_value.date()
-            else:
-                try:
-                    date_val = datetime.strptime(str(cell_value), "%m-%d-%y").date()
-                except:
-                    continue
-            if date_val <= threshold_date:
-                eligible_rows.append(row)
-
-    if not eligible_rows:
+    # Snapshot the sheet once: values and styles per row, padded to the
+    # header width (StyleArrays are shared references, not copies)
+    data_rows = []
+    style_rows = []
+    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
+        values = [cell.value for cell in row]
+        styles = [cell._style for cell in row]
+        while len(values) < len(headers):
+            values.append(None)
+            styles.append(None)
+        data_rows.append(values)
+        style_rows.append(styles)
+    header_styles = [cell._style for cell in ws[1]]
+    while len(header_styles) < len(headers):
+        header_styles.append(None)
+
+    case_pos = col_idx["Case"] - 1
+    date_pos = col_idx["Note Date"] - 1
+    note_pos = col_idx["Note"] - 1
+    file_pos = col_idx["File Name"] - 1
+    id_pos = col_idx["Example ID"] - 1
+
+    # Determine eligible rows based on Note Date (0-based into
+    # data_rows): one vectorized parse + compare instead of a strptime
+    # per row. Unparseable cells become NaT, which never passes the
+    # comparison; normalize() matches the old date-only comparison.
+    parsed = pd.to_datetime(
+        pd.Series([row_values[date_pos] for row_values in data_rows]),
+        format="%m-%d-%y", errors="coerce"
+    )
+    eligible_indices = np.flatnonzero(
+        parsed.dt.normalize().values <= np.datetime64(threshold_date)
+    ).tolist()
+
+    if not eligible_indices:
         logging.warning("No eligible rows found prior to 45 days from reference date.")
         return
 
-    logging.info(f"{len(eligible_rows)} eligible rows for insertion found.")
+    logging.info(f"{len(eligible_indices)} eligible rows for insertion found.")
 
     # Highlight for Note column
     highlight_fill = PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid")
 
-    random.shuffle(all_records)
-
-    for rec in all_records:
-        # Pick random eligible row
-        insert_row = random.choice(eligible_rows)
-        ws.insert_rows(insert_row)
-
-        # Copy Case and Note Date from row above
-        ws.cell(row=insert_row, column=col_idx["Case"], value=ws.cell(row=insert_row-1, column=col_idx["Case"]).value)
-        ws.cell(row=insert_row, column=col_idx["Note Date"], value=ws.cell(row=insert_row-1, column=col_idx["Note Date"]).value)
-
-        # Insert JSONL data
-        ws.cell(row=insert_row, column=col_idx["Note"], value=rec["Note"])
-        ws.cell(row=insert_row, column=col_idx["File Name"], value=rec["File Name"])
-        ws.cell(row=insert_row, column=col_idx["Example ID"], value=rec["Example ID"])
-
-        # Highlight Note column
-        ws.cell(row=insert_row, column=col_idx["Note"]).fill = highlight_fill
-
-        # Update eligible_rows indices to account for the inserted row
-        eligible_rows = [r+1 if r >= insert_row else r for r in eligible_rows]
+    # One C-level permutation instead of random.shuffle's per-element swaps
+    perm = np.random.default_rng().permutation(len(all_records))
+    all_records = [all_records[i] for i in perm.tolist()]
+
+    # Draw every insertion point up front instead of insert_rows per
+    # record (which shifts the whole sheet and forces an index remap
+    # each time — quadratic). The stable sort keeps records that share
+    # a slot in shuffled order; one merge pass then splices everything.
+    assignments = sorted(
+        ((random.choice(eligible_indices), rec) for rec in all_records),
+        key=lambda pair: pair[0],
+    )
+
+    # Stream the merged sheet out through a write-only workbook
+    out_wb = openpyxl.Workbook(write_only=True)
+    # The shared StyleArrays index into the source workbook's style
+    # tables, so the output workbook must share those tables
+    out_wb._fonts = wb._fonts
+    out_wb._fills = wb._fills
+    out_wb._borders = wb._borders
+    out_wb._alignments = wb._alignments
+    out_wb._protections = wb._protections
+    out_wb._number_formats = wb._number_formats
+    # Register the highlight once; highlighted cells reference it by
+    # name instead of triggering a style-registry write per cell
+    out_wb.add_named_style(NamedStyle(name="new_note_hl", fill=highlight_fill))
+
+    target_sheet = ws.title
+    for name in wb.sheetnames:
+        out_ws = out_wb.create_sheet(name)
+        if name == target_sheet:
+            header_row = []
+            for value, style in zip(headers, header_styles):
+                if style:
+                    cell = WriteOnlyCell(out_ws, value=value)
+                    cell._style = style
+                    header_row.append(cell)
+                else:
+                    header_row.append(value)
+            out_ws.append(header_row)
+
+            a_i = 0
+            prev = headers  # the header row sits above the first data row
+            for idx, (row_values, row_styles) in enumerate(zip(data_rows, style_rows)):
+                while a_i < len(assignments) and assignments[a_i][0] == idx:
+                    rec = assignments[a_i][1]
+                    new_row = [None] * len(headers)
+                    # Copy Case and Note Date from the row above
+                    new_row[case_pos] = prev[case_pos]
+                    new_row[date_pos] = prev[date_pos]
+                    new_row[note_pos] = rec["Note"]
+                    new_row[file_pos] = rec["File Name"]
+                    new_row[id_pos] = rec["Example ID"]
+                    out_row = list(new_row)
+                    note_cell = WriteOnlyCell(out_ws, value=new_row[note_pos])
+                    note_cell.style = "new_note_hl"
+                    out_row[note_pos] = note_cell
+                    out_ws.append(out_row)
+                    prev = new_row
+                    a_i += 1
+                out_row = []
+                for value, style in zip(row_values, row_styles):
+                    if style:
+                        cell = WriteOnlyCell(out_ws, value=value)
+                        cell._style = style
+                        out_row.append(cell)
+                    else:
+                        out_row.append(value)
+                out_ws.append(out_row)
+                prev = row_values
+        else:
+            for row in wb[name].iter_rows(values_only=True):
+                out_ws.append(row)
 
-    wb.save(excel_file)
     wb.close()
+    out_wb.save(excel_file)
     logging.info(f"✅ Successfully inserted {len(all_records)} JSONL notes into existing sheet.")
@@ -1,11 +1,16 @@
-import json
+import orjson
 import random
+import numpy as np
 import os
 import openpyxl
+import pandas as pd
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill
+from openpyxl.styles import PatternFill, NamedStyle
+from openpyxl.cell import WriteOnlyCell
+from concurrent.futures import ProcessPoolExecutor
 import copy
 import logging
+from pathlib import Path
 from datetime import datetime, timedelta
 
 # Configure logging
@@ -14,6 +19,33 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+REQUIRED_HEADERS = ("Case", "Note Date", "Note", "File Name", "Example ID")
+
+def _parse_jsonl_file(file_path):
+    """Worker: parse one .jsonl file into a list of record dicts."""
+    clean_name = file_path.stem
+    records = []
+    try:
+        # One bytes read per file; orjson parses the bytes directly
+        # and the BOM is stripped once up front
+        data = file_path.read_bytes()
+        if data.startswith(b'\xef\xbb\xbf'):
+            data = data[3:]
+        for line in data.splitlines():
+            if not line:
+                continue
+            rec = orjson.loads(line)
+            records.append({
+                "Case": None,
+                "Note Date": None,
+                "Note": rec.get("text", ""),
+                "File Name": clean_name,
+                "Example ID": rec.get("example_id")
+            })
+    except Exception as e:
+        logging.error(f"Failed to read {file_path}: {e}")
+    return records
+
 def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_sheet_name="CombinedNotes"):
     """
     Create a new sheet combining existing notes and JSONL notes.
@@ -29,26 +61,14 @@ def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_shee
     all_jsonl_records = []
     logging.info(f"Scanning directory: {input_dir}")
 
-    # Load JSONL files
-    for root, _, files in os.walk(input_dir):
-        for file_name in files:
-            if file_name.endswith(".jsonl"):
-                file_path = os.path.join(root, file_name)
-                clean_name = os.path.splitext(file_name)[0]
-                try:
-                    with open(file_path, "r", encoding="utf-8-sig") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_jsonl_records.append({
-                                "Case": None,
-                                "Note Date": None,
-                                "Note": rec.get("text", ""),
-                                "File Name": clean_name,
-                                "Example ID": rec.get("example_id")
-                            })
-                    logging.info(f"Loaded {file_name} → {len(all_jsonl_records)} records total")
-                except Exception as e:
-                    logging.error(f"Failed to read {file_path}: {e}")
+    # Load JSONL files: each one parses independently, so the orjson
+    # decoding fans out across cores; chunksize keeps IPC overhead low
+    # rglob walks the tree without os.walk's per-directory tuple churn
+    jsonl_paths = list(Path(input_dir).rglob("*.jsonl"))
+    with ProcessPoolExecutor() as ex:
+        for recs in ex.map(_parse_jsonl_file, jsonl_paths, chunksize=4):
+            all_jsonl_records.extend(recs)
+    logging.info(f"Loaded {len(all_jsonl_records)} records from {len(jsonl_paths)} JSONL files")
 
     if not all_jsonl_records:
         logging.warning("No JSONL files found.")
@@ -64,14 +84,15 @@ def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_shee
 
     # Prepare headers
     headers = [cell.value for cell in old_sheet[1]]
-    required_headers = ["Case", "Note Date", "Note", "File Name", "Example ID"]
-    for header in required_headers:
+    for header in REQUIRED_HEADERS:
         if header not in headers:
             headers.append(header)
 
-    note_col_idx = headers.index("Note") + 1
-    note_date_col_idx = headers.index("Note Date") + 1
-    case_col_idx = headers.index("Case") + 1
+    # One pass over headers instead of a linear .index scan per column
+    col_idx = {h: i + 1 for i, h in enumerate(headers)}
+    note_col_idx = col_idx["Note"]
+    note_date_col_idx = col_idx["Note Date"]
+    case_col_idx = col_idx["Case"]
 
     # Read existing data and styles
     existing_data = []
@@ -79,27 +100,26 @@ def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_shee
 
     for row in old_sheet.iter_rows(min_row=2, max_row=old_sheet.max_row):
         values = [cell.value for cell in row]
-        styles = [copy.copy(cell._style) for cell in row]
+        # StyleArray is an immutable index tuple into the workbook's
+        # style tables, so sharing the reference is safe — no per-cell copy
+        styles = [cell._style for cell in row]
         while len(values) < len(headers):
             values.append(None)
             styles.append(None)
         existing_data.append(values)
         existing_styles.append(styles)
 
-    # Determine eligible indices based on Note Date in MM-DD-YY
-    eligible_indices = []
-    for idx, row in enumerate(existing_data):
-        cell_date = row[note_date_col_idx - 1]
-        if cell_date:
-            if isinstance(cell_date, datetime):
-                date_val = cell_date.date()
-            else:
-                try:
-                    date_val = datetime.strptime(str(cell_date), "%m-%d-%y").date()
-                except:
-                    continue
-            if date_val <= threshold_date:
-                eligible_indices.append(idx)
+    # Determine eligible indices based on Note Date in MM-DD-YY: one
+    # vectorized parse + compare instead of a strptime per row.
+    # Unparseable cells become NaT, which never passes the comparison;
+    # normalize() matches the old date-only comparison.
+    parsed = pd.to_datetime(
+        pd.Series([row[note_date_col_idx - 1] for row in existing_data]),
+        format="%m-%d-%y", errors="coerce"
+    )
+    eligible_indices = np.flatnonzero(
+        parsed.dt.normalize().values <= np.datetime64(threshold_date)
+    ).tolist()
 
     # Ensure minimum eligible index is 1 (row 2 in Excel) to protect header
     eligible_indices = [i for i in eligible_indices if i >= 1]
@@ -112,6 +132,17 @@ def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_shee
     # Insert JSONL records at random eligible positions
     combined_data = existing_data.copy()
     combined_styles = existing_styles.copy()
+    # Track which rows are new JSONL notes as they are spliced in, so
+    # the write loop never rescans all_jsonl_records per cell
+    combined_is_new = [False] * len(existing_data)
+
+    # Cached 0-based column positions so the splice loop never rescans
+    # headers or walks rec.get per header
+    case_pos = case_col_idx - 1
+    date_pos = note_date_col_idx - 1
+    note_pos = note_col_idx - 1
+    file_pos = col_idx["File Name"] - 1
+    id_pos = col_idx["Example ID"] - 1
 
     for rec in all_jsonl_records:
         if eligible_indices:
@@ -119,45 +150,88 @@ def insert_jsonl_safe_insert(input_dir, excel_file, reference_date_str, new_shee
         else:
             insert_idx = len(combined_data)
 
-        # Copy Case and Note Date from row above if exists
+        # Prepare new row values; Case and Note Date come from the row
+        # above if one exists
+        new_row_values = [None] * len(headers)
         if insert_idx > 0:
-            rec["Case"] = combined_data[insert_idx - 1][case_col_idx - 1]
-            rec["Note Date"] = combined_data[insert_idx - 1][note_date_col_idx - 1]
-
-        # Prepare new row values
-        new_row_values = [rec.get(h, None) for h in headers]
+            new_row_values[case_pos] = combined_data[insert_idx - 1][case_pos]
+            new_row_values[date_pos] = combined_data[insert_idx - 1][date_pos]
+        new_row_values[note_pos] = rec["Note"]
+        new_row_values[file_pos] = rec["File Name"]
+        new_row_values[id_pos] = rec["Example ID"]
         combined_data.insert(insert_idx, new_row_values)
 
         # Inherit style from row above if exists
         inherited_style = combined_styles[insert_idx - 1] if insert_idx > 0 else [None] * len(headers)
         combined_styles.insert(insert_idx, inherited_style)
+        combined_is_new.insert(insert_idx, True)
 
         # Update eligible indices
         eligible_indices = [i+1 if i>=insert_idx else i for i in eligible_indices]
 
-    # Create new sheet
-    if new_sheet_name in wb.sheetnames:
-        ws = wb[new_sheet_name]
-        wb.remove(ws)
-    ws = wb.create_sheet(title=new_sheet_name)
-
-    # Write headers
-    for col_idx, header in enumerate(headers, start=1):
-        ws.cell(row=1, column=col_idx, value=header)
-
-    # Write all rows with styles and highlight only Note column
-    for row_idx, (row_values, row_styles) in enumerate(zip(combined_data, combined_styles), start=2):
+    # Stream the output through a write-only workbook: existing sheets
+    # are copied through (values only) and the combined sheet only
+    # builds a WriteOnlyCell where a style or highlight is needed
+    out_wb = Workbook(write_only=True)
+    # The copied StyleArrays index into the source workbook's style
+    # tables, so the output workbook must share those tables
+    out_wb._fonts = wb._fonts
+    out_wb._fills = wb._fills
+    out_wb._borders = wb._borders
+    out_wb._alignments = wb._alignments
+    out_wb._protections = wb._protections
+    out_wb._number_formats = wb._number_formats
+    # Register the highlight once; highlighted cells with no inherited
+    # formatting reference it by name instead of triggering a
+    # style-registry write per cell
+    out_wb.add_named_style(NamedStyle(name="new_note_hl", fill=highlight_fill))
+
+    for name in wb.sheetnames:
+        if name == new_sheet_name:
+            continue  # rebuilt below
+        out_ws = out_wb.create_sheet(name)
+        for row in wb[name].iter_rows(values_only=True):
+            out_ws.append(row)
+
+    ws = out_wb.create_sheet(title=new_sheet_name)
+    ws.append(headers)
+    hl_variants = {}
+    for row_values, row_styles, is_new in zip(combined_data, combined_styles, combined_is_new):
+        # Rows with no styles and no highlight skip the cell loop
+        # entirely — the common path stays allocation-free
+        if not is_new and not any(row_styles):
+            ws.append(row_values)
+            continue
+        out_row = []
         for col_idx, (value, style) in enumerate(zip(row_values, row_styles), start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            if style:
-                cell._style = copy.copy(style)
-            if col_idx == note_col_idx and row_values[headers.index("File Name")] and row_values[headers.index("Note")] in [r["Note"] for r in all_jsonl_records]:
-                cell.fill = highlight_fill
+            highlight = is_new and col_idx == note_col_idx
+            if style or highlight:
+                cell = WriteOnlyCell(ws, value=value)
+                if highlight and style:
+                    # Intern the highlighted variant of each distinct
+                    # inherited style: the clone + fill mutation runs
+                    # once per style, not once per highlighted cell
+                    variant = hl_variants.get(id(style))
+                    if variant is None:
+                        probe = WriteOnlyCell(ws)
+                        probe._style = copy.copy(style)
+                        probe.fill = highlight_fill
+                        variant = probe._style
+                        hl_variants[id(style)] = variant
+                    cell._style = variant
+                elif highlight:
+                    cell.style = "new_note_hl"
+                else:
+                    cell._style = style  # borrow the shared StyleArray
+                out_row.append(cell)
+            else:
+                out_row.append(value)
+        ws.append(out_row)
 
     # Save workbook
     try:
-        wb.save(excel_file)
         wb.close()
+        out_wb.save(excel_file)
         logging.info(f"✅ Successfully created new sheet '{new_sheet_name}' with safe insertion, Case & Note Date copied, and Note highlighted.")
     except Exception as e:
         logging.error(f"❌ Failed to save Excel file: {e}")
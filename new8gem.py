@@ -1,10 +1,11 @@
-import json
+import orjson
 import random
 import os
 import openpyxl
 import logging
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Border, Alignment # Import specific style components
+from openpyxl.styles import PatternFill
+from openpyxl.styles.cell_style import StyleArray
 from datetime import datetime, timedelta
 import copy
 
@@ -86,18 +87,26 @@ def consolidate_excel_jsonl_insertion(
                 file_path = os.path.join(root, file_name)
                 clean_name = os.path.splitext(file_name)[0]
                 try:
-                    with open(file_path, "r", encoding="utf-8-sig") as f:
-                        for line in f:
-                            rec = json.loads(line)
-                            all_jsonl_records.append({
-                                "Case": None, # Will be copied from above
-                                "Note Date": None, # Will be copied from above
-                                "Note": rec.get("text", ""),
-                                "File Name": clean_name,
-                                "Example ID": rec.get("example_id")
-                            })
+                    # One bytes read per file; orjson parses the bytes
+                    # directly and the BOM is stripped once up front
+                    # (the old utf-8-sig behaviour)
+                    with open(file_path, "rb") as f:
+                        data = f.read()
+                    if data.startswith(b'\xef\xbb\xbf'):
+                        data = data[3:]
+                    for line in data.splitlines():
+                        if not line:
+                            continue
+                        rec = orjson.loads(line)
+                        all_jsonl_records.append({
+                            "Case": None, # Will be copied from above
+                            "Note Date": None, # Will be copied from above
+                            "Note": rec.get("text", ""),
+                            "File Name": clean_name,
+                            "Example ID": rec.get("example_id")
+                        })
                     logging.info(f"Loaded {file_name} → {len(all_jsonl_records)} total records so far.")
-                except json.JSONDecodeError as e:
+                except orjson.JSONDecodeError as e:
                     logging.error(f"❌ Failed to parse JSONL line in {file_path}: {e}")
                 except Exception as e:
                     logging.error(f"❌ Failed to read {file_path}: {e}")
@@ -145,25 +154,21 @@ def consolidate_excel_jsonl_insertion(
 
     # 5. Read existing data and styles
     existing_rows_data = [] # List of lists for cell values
-    existing_rows_styles = [] # List of lists of dictionaries for style components
+    existing_rows_styles = [] # List of lists of StyleArray references
 
-    # Start from row 2 to skip header
-    for r_idx in range(2, ws.max_row + 1):
+    # Start from row 2 to skip header; max_row is recomputed on every
+    # access, so cache it once before the loop
+    max_row = ws.max_row
+    for r_idx in range(2, max_row + 1):
         row_values = []
         row_styles = []
         for c_idx in range(1, len(headers) + 1): # Iterate up to the number of columns we care about
             cell = ws.cell(row=r_idx, column=c_idx)
             row_values.append(cell.value)
-            
-            # Store style components as a dictionary for easier copying
-            cell_style_dict = {
-                'font': copy.copy(cell.font) if cell.font else None,
-                'fill': copy.copy(cell.fill) if cell.fill else None,
-                'border': copy.copy(cell.border) if cell.border else None,
-                'alignment': copy.copy(cell.alignment) if cell.alignment else None,
-                # Add other style properties if needed (e.g., protection, number_format)
-            }
-            row_styles.append(cell_style_dict)
+            # StyleArray is just an index array into the workbook's
+            # style tables — the raw reference is enough for read-only
+            # inheritance, no per-cell copy needed
+            row_styles.append(cell._style)
         existing_rows_data.append(row_values)
         existing_rows_styles.append(row_styles)
 
@@ -193,6 +198,13 @@ def consolidate_excel_jsonl_insertion(
     combined_data = existing_rows_data.copy()
     combined_styles = existing_rows_styles.copy()
     highlight_fill = PatternFill(start_color=highlight_color, end_color=highlight_color, fill_type="solid")
+    # Register the fill once in the workbook's fill table; highlighted
+    # styles reference it by index
+    highlight_fill_id = wb._fills.add(highlight_fill)
+    # Intern one highlighted StyleArray per distinct inherited style —
+    # the clone + fillId swap runs once per style, not once per note
+    highlight_cache = {}
+    note_col_index_0based = col_map["Note"] - 1
 
     for idx, rec in enumerate(all_jsonl_records):
         # Choose a random eligible index
@@ -203,30 +215,32 @@ def consolidate_excel_jsonl_insertion(
             prev_row_data = combined_data[insert_pos_in_combined - 1]
             rec["Case"] = prev_row_data[col_map["Case"] - 1]
             rec["Note Date"] = prev_row_data[col_map["Note Date"] - 1]
-            inherited_style_row_dicts = combined_styles[insert_pos_in_combined - 1]
+            inherited_styles = combined_styles[insert_pos_in_combined - 1]
         else: # Inserting at the very beginning (after header)
             rec["Case"] = None
             rec["Note Date"] = None
-            inherited_style_row_dicts = [{
-                'font': None, 'fill': None, 'border': None, 'alignment': None
-            }] * len(headers) # No style to inherit, create empty style dicts
+            inherited_styles = [None] * len(headers) # No style to inherit
 
         # Prepare new row values based on current headers order
         new_row_values = [rec.get(h, None) for h in headers]
         combined_data.insert(insert_pos_in_combined, new_row_values)
 
-        # Prepare new row styles: inherit from above, but highlight 'Note'
-        new_row_style_dicts = [copy.deepcopy(s_dict) if s_dict else {
-            'font': None, 'fill': None, 'border': None, 'alignment': None
-        } for s_dict in inherited_style_row_dicts]
-
-        note_col_index_0based = col_map["Note"] - 1
-        if note_col_index_0based < len(new_row_style_dicts):
-            new_row_style_dicts[note_col_index_0based]['fill'] = highlight_fill
+        # Inherit styles from above by reference, but highlight 'Note'
+        new_row_styles = list(inherited_styles)
+
+        if note_col_index_0based < len(new_row_styles):
+            base_style = new_row_styles[note_col_index_0based]
+            cache_key = id(base_style) if base_style is not None else None
+            variant = highlight_cache.get(cache_key)
+            if variant is None:
+                variant = copy.copy(base_style) if base_style is not None else StyleArray()
+                variant.fillId = highlight_fill_id
+                highlight_cache[cache_key] = variant
+            new_row_styles[note_col_index_0based] = variant
         else: # Should not happen if headers are correctly managed, but for safety
             logging.warning(f"Note column index {note_col_index_0based} out of bounds for new row styles. Highlighting skipped.")
 
-        combined_styles.insert(insert_pos_in_combined, new_row_style_dicts)
+        combined_styles.insert(insert_pos_in_combined, new_row_styles)
 
         # Update eligible indices to reflect the new row insertion
         # This logic needs to be careful: if we insert at `idx`, all subsequent indices shift by 1.
@@ -249,15 +263,23 @@ def consolidate_excel_jsonl_insertion(
             ws.delete_rows(2, ws.max_row - 1)
         logging.info("Cleared existing data rows from worksheet.")
 
-        for r_idx, (row_values, row_style_dicts) in enumerate(zip(combined_data, combined_styles), start=2):
-            for c_idx, (value, style_dict) in enumerate(zip(row_values, row_style_dicts), start=1):
-                cell = ws.cell(row=r_idx, column=c_idx, value=value)
-                if style_dict:
-                    if style_dict['font']: cell.font = style_dict['font']
-                    if style_dict['fill']: cell.fill = style_dict['fill']
-                    if style_dict['border']: cell.border = style_dict['border']
-                    if style_dict['alignment']: cell.alignment = style_dict['alignment']
-                    # Apply other style properties here if stored in style_dict
+        # Bulk-append the values first (one append per row instead of a
+        # ws.cell coordinate lookup per cell), tracking the cells that
+        # actually carry styling in a sparse {(row, col): style} map —
+        # default-styled cells never make it into the map
+        default_style = StyleArray()
+        styled_cells = {}
+        for r_idx, (row_values, row_styles) in enumerate(zip(combined_data, combined_styles), start=2):
+            ws.append(row_values)
+            for c_idx, style in enumerate(row_styles, start=1):
+                if style is not None and style != default_style:
+                    styled_cells[(r_idx, c_idx)] = style
+
+        # Then visit only the styled cells for targeted assignments —
+        # assigning the shared StyleArray reference is a single slot
+        # write, no style-registry round trip per cell
+        for (r_idx, c_idx), style in styled_cells.items():
+            ws.cell(row=r_idx, column=c_idx)._style = style
         logging.info(f"Wrote back {len(combined_data)} rows to worksheet.")
     except Exception as e:
         logging.error(f"❌ Error writing data back to worksheet: {e}")